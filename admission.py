@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Niveles de carga, de menor a mayor degradación.
+LEVEL_NORMAL = 0
+LEVEL_NO_ANALYSIS = 1        # No se analizan tokens.
+LEVEL_DIGEST = 2             # Los watches normales reciben un resumen periódico en vez de cada mensaje.
+LEVEL_PRIORITY_ONLY = 3      # Solo se atienden los watches marcados como prioritarios.
+
+
+class AdmissionController:
+    """
+    Queues between the update handlers and the workers that filter and forward
+    messages, sharing a single capacity of `maxsize` items. The queued work
+    decides how much is shed: when it fills past each threshold the pipeline
+    degrades one more level, and when it is full new work is rejected instead
+    of piling up in memory.
+
+    Work is sharded by a key (the source chat) and each shard has one worker,
+    so messages from the same source are processed in the order they arrived.
+    Any shard can use the whole capacity, so a spike from a single source also
+    raises the load level.
+    """
+
+    def __init__(self, maxsize: int, shards: int = 1, thresholds: tuple = (0.5, 0.75, 0.9), poll_interval: float = 1.0):
+        self.queues = [asyncio.Queue() for _ in range(shards)]
+        self.maxsize = maxsize
+        self._depth = 0
+        self.thresholds = thresholds
+        self.poll_interval = poll_interval
+        self.shed_counts = Counter()
+        self.processed = 0
+
+    def depth(self) -> int:
+        return self._depth
+
+    def level(self) -> int:
+        fill = self.depth() / self.maxsize
+        return sum(1 for threshold in self.thresholds if fill >= threshold)
+
+    def has_room(self, reserved: int = 0) -> bool:
+        """Whether one more item fits, counting `reserved` items already promised (e.g. albums being collected)."""
+        return self.depth() + reserved < self.maxsize
+
+    def submit(self, key, item) -> bool:
+        """Enqueues work on the shard of `key` without waiting. Returns False (and counts it) if the capacity is used up."""
+        if self._depth >= self.maxsize:
+            self.record_shed("queue_full")
+            return False
+        self.queues[hash(key) % len(self.queues)].put_nowait(item)
+        self._depth += 1
+        return True
+
+    def record_shed(self, reason: str):
+        self.shed_counts[reason] += 1
+
+    async def run_worker(self, shard: int, process, running=lambda: True):
+        """
+        Consumes one shard, passing each item and the current load level to `process`.
+        Returns once `running()` is false and the shard has been drained.
+        """
+        queue = self.queues[shard]
+        while running() or not queue.empty():
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                continue
+            self._depth -= 1
+            try:
+                await process(item, self.level())
+            except Exception:
+                logger.exception("Pipeline worker failed to process an item")
+            finally:
+                self.processed += 1
+                queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.depth(),
+            'queue_size': self.maxsize,
+            'load_level': self.level(),
+            'processed': self.processed,
+            'shed': dict(self.shed_counts),
+        }
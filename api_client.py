@@ -1,6 +1,11 @@
+import logging
+from functools import lru_cache
+
 import requests
 import config
 
+logger = logging.getLogger(__name__)
+
 MOCK_DEXSCREENER_RESPONSE = {
     "pairs": [{
         "chainId": "solana", "dexId": "raydium", "url": "https://dexscreener.com/solana/...",
@@ -24,7 +29,7 @@ def get_token_analysis(token_address: str) -> dict:
     Fetches and prepares token data for formatting. Returns a single dictionary.
     """
     if config.ENVIRONMENT == "development":
-        print("--- MODO DE PRUEBA LOCAL ACTIVADO: Devolviendo datos de prueba. ---")
+        logger.debug("MODO DE PRUEBA LOCAL ACTIVADO: Devolviendo datos de prueba.", extra={'token_address': token_address})
         return {"pair_data": MOCK_DEXSCREENER_RESPONSE["pairs"][0]}
 
     BASE_URL = "https://api.dexscreener.com/latest/dex"
@@ -53,54 +58,82 @@ def get_token_analysis(token_address: str) -> dict:
     except Exception as e:
         return {"error": f"An unexpected error occurred: {e}"}
 
+NO_MARKET_DATA_TEMPLATE = (
+    "<b>{name}</b> (<code>${symbol}</code>)\n\n"
+    "⚠️ <b>No Market Data Found:</b>\n"
+    "<i>{error}</i>\n\n"
+    "🔗 <b><u>Associated Links:</u></b>\n"
+    "<a href='https://solscan.io/token/{address}'>Solscan</a> | "
+    "<a href='https://rugcheck.xyz/tokens/{address}'>RugCheck</a>"
+)
+FULL_ANALYSIS_TEMPLATE = (
+    "<b>{name}</b> (<code>${symbol}</code>)\n\n"
+    "<b>Price:</b> <code>${price_usd}</code> ({change_symbol} {price_change_24h}%)\n"
+    "<b>Value:</b> <code>{price_native} ${quote_symbol}</code>\n\n"
+    "📊 <b><u>Statistics:</u></b>\n"
+    "<b>Market Cap:</b> <code>${market_cap}</code>\n"
+    "<b>24h Volume:</b> <code>${volume_24h}</code>\n\n"
+    "🔗 <b><u>Associated Links:</u></b>\n"
+    "<a href='{url}'>DexScreener</a> | "
+    "<a href='https://solscan.io/token/{address}'>Solscan</a> | "
+    "<a href='https://rugcheck.xyz/tokens/{address}'>RugCheck</a>"
+)
+
+
 def format_token_analysis(analysis_result: dict) -> str:
     """
     Takes a result dictionary and formats it into a full or "Lite" analysis message.
+    The fields used are reduced to a snapshot tuple, so identical data is only rendered once.
     """
     error_message = analysis_result.get("error")
     pair_data = analysis_result.get("pair_data")
     token_info = analysis_result.get("token_info")
 
-    # --- INICIO DE LA LÓGICA CORREGIDA ---
-
     # Si no tenemos ningún dato del token, mostramos el error principal
     if not pair_data and not token_info:
         return f"⚠️ <b>Analysis Failed:</b>\n<i>{error_message or 'Token not found.'}</i>"
 
     # Si tenemos info del token (del caso de error) pero no del par, la usamos
     if not pair_data and token_info:
-        base_token = token_info
-        message = (
-            f"<b>{base_token.get('name', 'N/A')}</b> (<code>${base_token.get('symbol', 'N/A')}</code>)\n\n"
-            f"⚠️ <b>No Market Data Found:</b>\n"
-            f"<i>{error_message}</i>\n\n"
-            f"🔗 <b><u>Associated Links:</u></b>\n"
-            f"<a href='https://solscan.io/token/{base_token.get('address')}'>Solscan</a> | "
-            f"<a href='https://rugcheck.xyz/tokens/{base_token.get('address')}'>RugCheck</a>"
-        )
-        return message
+        return _render_no_market_data((
+            token_info.get('name', 'N/A'), token_info.get('symbol', 'N/A'), token_info.get('address'), error_message,
+        ))
 
     # Si llegamos aquí, es porque tenemos datos completos del par
     base_token = pair_data.get('baseToken', {})
-    quote_token = pair_data.get('quoteToken', {})
-    price_usd = pair_data.get('priceUsd')
-    price_native = pair_data.get('priceNative')
-    market_cap = pair_data.get('fdv')
-    volume_24h = pair_data.get('volume', {}).get('h24')
-    price_change_24h = pair_data.get('priceChange', {}).get('h24', 0)
-    
-    change_symbol = "📈" if price_change_24h >= 0 else "📉"
-    
-    message = (
-        f"<b>{base_token.get('name')}</b> (<code>${base_token.get('symbol')}</code>)\n\n"
-        f"<b>Price:</b> <code>${price_usd}</code> ({change_symbol} {price_change_24h}%)\n"
-        f"<b>Value:</b> <code>{price_native} ${quote_token.get('symbol')}</code>\n\n"
-        f"📊 <b><u>Statistics:</u></b>\n"
-        f"<b>Market Cap:</b> <code>${format_large_number(market_cap)}</code>\n"
-        f"<b>24h Volume:</b> <code>${format_large_number(volume_24h)}</code>\n\n"
-        f"🔗 <b><u>Associated Links:</u></b>\n"
-        f"<a href='{pair_data.get('url')}'>DexScreener</a> | "
-        f"<a href='https://solscan.io/token/{base_token.get('address')}'>Solscan</a> | "
-        f"<a href='https://rugcheck.xyz/tokens/{base_token.get('address')}'>RugCheck</a>"
+    return _render_full_analysis((
+        base_token.get('name'),
+        base_token.get('symbol'),
+        base_token.get('address'),
+        pair_data.get('quoteToken', {}).get('symbol'),
+        pair_data.get('priceUsd'),
+        pair_data.get('priceNative'),
+        pair_data.get('fdv'),
+        pair_data.get('volume', {}).get('h24'),
+        pair_data.get('priceChange', {}).get('h24', 0),
+        pair_data.get('url'),
+    ))
+
+
+@lru_cache(maxsize=1024)
+def _render_no_market_data(snapshot: tuple) -> str:
+    name, symbol, address, error_message = snapshot
+    return NO_MARKET_DATA_TEMPLATE.format(name=name, symbol=symbol, address=address, error=error_message)
+
+
+@lru_cache(maxsize=1024)
+def _render_full_analysis(snapshot: tuple) -> str:
+    name, symbol, address, quote_symbol, price_usd, price_native, market_cap, volume_24h, price_change_24h, url = snapshot
+    return FULL_ANALYSIS_TEMPLATE.format(
+        name=name,
+        symbol=symbol,
+        address=address,
+        quote_symbol=quote_symbol,
+        price_usd=price_usd,
+        price_native=price_native,
+        change_symbol="📈" if price_change_24h >= 0 else "📉",
+        price_change_24h=price_change_24h,
+        market_cap=format_large_number(market_cap),
+        volume_24h=format_large_number(volume_24h),
+        url=url,
     )
-    return message
\ No newline at end of file
@@ -0,0 +1,56 @@
+# bench_filters.py - Microbenchmark del motor de filtros.
+#
+# Mide el coste por mensaje de CompiledFilters.matches_text a medida que crece
+# el número de filtros de un watch. Uso: python bench_filters.py
+
+import random
+import string
+import timeit
+
+import filter_engine
+
+MESSAGE = (
+    "🚀 New listing alert: $WIF just launched on raydium with a big liquidity pool, "
+    "early buyers are already up 3x. Not financial advice, do your own research! "
+    "CA: EKpQGSJtjMFqKZ9KQanSqYXRcF8fBopzL7qrN5L3n3g"
+)
+FILTER_COUNTS = {
+    "phrase_include": [10, 100, 1_000, 5_000],
+    "regex_include": [1, 10, 50, filter_engine.MAX_REGEX_FILTERS],
+    # Cada expresión booleana se evalúa por separado; no se esperan cientos por watch.
+    "boolean": [1, 10, 50],
+}
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 10)))
+
+
+def build_filters(filter_type: str, count: int, rng: random.Random) -> list:
+    rows = []
+    for _ in range(count):
+        if filter_type == "phrase_include":
+            value = " ".join(random_word(rng) for _ in range(rng.randint(1, 3)))
+        elif filter_type == "regex_include":
+            value = rf"\b{random_word(rng)}\d*\b"
+        else:
+            value = f"{random_word(rng)} AND ({random_word(rng)} OR \"{random_word(rng)} {random_word(rng)}\")"
+        rows.append({'filter_type': filter_type, 'filter_value': value})
+    return rows
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'filter type':<16}{'filters':>9}{'µs/message':>14}")
+    for filter_type, counts in FILTER_COUNTS.items():
+        for count in counts:
+            compiled = filter_engine.CompiledFilters(build_filters(filter_type, count, rng))
+            number = 2_000
+            seconds = timeit.timeit(
+                lambda: compiled.matches_text(filter_engine.PreparedText(MESSAGE)), number=number
+            )
+            print(f"{filter_type:<16}{count:>9}{seconds / number * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# bench_rendering.py - Microbenchmark de la capa de renderizado.
+#
+# Compara el coste de formatear un mensaje para N destinos reconstruyendo el
+# footer y el teclado en cada envío (como se hacía antes) frente a
+# rendering.MessageRender, y el análisis de tokens con y sin caché por
+# snapshot. Uso: python bench_rendering.py
+
+import datetime
+import timeit
+
+from telegram import Chat, InlineKeyboardButton, InlineKeyboardMarkup, Message, User
+
+import api_client
+import rendering
+
+DESTINATION_COUNTS = [1, 10, 100, 1_000]
+
+
+def build_per_destination(message: Message, target_id: int):
+    """The previous approach: everything is rebuilt for every destination."""
+    author = message.from_user.mention_html()
+    if message.chat.username:
+        message_link = f"https://t.me/{message.chat.username}/{message.message_id}"
+    else:
+        message_link = f"https://t.me/c/{str(message.chat.id)[4:]}/{message.message_id}"
+    footer = (
+        f"\n\n🎯 — — — — — — — — 🎯\n"
+        f"🔔 <b>Notification from:</b> {author}\n"
+        f"🌐 <b>Source:</b> {message.chat.title}"
+    )
+    reply_markup = InlineKeyboardMarkup([[
+        InlineKeyboardButton("🚀 Jump to Message", url=message_link),
+        InlineKeyboardButton("🗑️ Stop Tracking", callback_data=f"stop_watch:{target_id}")
+    ]])
+    return (message.text or message.caption or "") + footer, reply_markup
+
+
+def build_with_render(render: rendering.MessageRender, target_id: int):
+    return render.content, render.keyboard(target_id)
+
+
+def main():
+    message = Message(
+        message_id=4242,
+        date=datetime.datetime.now(datetime.timezone.utc),
+        chat=Chat(id=-1001234567890, type=Chat.SUPERGROUP, title="Alpha Calls"),
+        from_user=User(id=777, first_name="Whale", is_bot=False, username="whale"),
+        text="🚀 $WIF breaking out, CA: EKpQGSJtjMFqKZ9KQanSqYXRcF8fBopzL7qrN5L3n3g",
+    )
+
+    print(f"{'destinations':>12}{'per-destination µs':>22}{'MessageRender µs':>20}")
+    for count in DESTINATION_COUNTS:
+        number = max(1, 2_000 // count)
+        legacy = timeit.timeit(
+            lambda: [build_per_destination(message, target_id) for target_id in range(count)], number=number
+        ) / number
+        cached = timeit.timeit(
+            lambda: [build_with_render(render, target_id)
+                     for render in [rendering.MessageRender([message])]
+                     for target_id in range(count)],
+            number=number,
+        ) / number
+        print(f"{count:>12}{legacy * 1e6:>22.1f}{cached * 1e6:>20.1f}")
+
+    analysis_result = {"pair_data": api_client.MOCK_DEXSCREENER_RESPONSE["pairs"][0]}
+    number = 20_000
+    pair = analysis_result["pair_data"]
+    snapshot = (
+        pair["baseToken"]["name"], pair["baseToken"]["symbol"], pair["baseToken"]["address"], pair["quoteToken"]["symbol"],
+        pair["priceUsd"], pair["priceNative"], pair["fdv"], pair["volume"]["h24"], pair["priceChange"]["h24"], pair["url"],
+    )
+    uncached = timeit.timeit(lambda: api_client._render_full_analysis.__wrapped__(snapshot), number=number) / number
+    cached = timeit.timeit(lambda: api_client.format_token_analysis(analysis_result), number=number) / number
+    print(f"\nformat_token_analysis: uncached {uncached * 1e6:.2f} µs, cached snapshot {cached * 1e6:.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import csv
+import io
+import json
+
+import filter_engine
+
+CSV_FIELDS = ["target_user_id", "source_group_id", "target_username", "priority", "filter_type", "filter_value"]
+MAX_IMPORT_BYTES = 5 * 1024 * 1024
+MAX_IMPORT_WATCHES = 20_000
+
+
+def parse_import(raw: bytes, file_name: str) -> list:
+    """
+    Parses a CSV or JSON watchlist into a list of watches:
+    {"target_user_id", "source_group_id", "target_username", "priority", "filters": [(type, value), ...]}.
+    CSV files have one row per filter (the filter columns may be empty); rows of the
+    same watch are merged. Raises ValueError with a user-facing message on bad input.
+    """
+    if len(raw) > MAX_IMPORT_BYTES:
+        raise ValueError(f"The file is too large (max {MAX_IMPORT_BYTES // (1024 * 1024)} MB).")
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError("The file must be UTF-8 encoded.")
+
+    if file_name.lower().endswith(".json") or text.lstrip().startswith(("{", "[")):
+        entries = _read_json_entries(text)
+    else:
+        entries = _read_csv_entries(text)
+
+    watches = {}
+    for line_number, entry in enumerate(entries, start=1):
+        try:
+            target_user_id = int(entry["target_user_id"])
+            source_group_id = str(int(entry["source_group_id"]))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Entry {line_number}: target_user_id and source_group_id must be numeric IDs.")
+
+        key = (source_group_id, target_user_id)
+        watch = watches.get(key)
+        if watch is None:
+            if len(watches) >= MAX_IMPORT_WATCHES:
+                raise ValueError(f"Too many watches in one file (max {MAX_IMPORT_WATCHES}).")
+            watch = watches[key] = {
+                "target_user_id": target_user_id,
+                "source_group_id": source_group_id,
+                "target_username": None,
+                "priority": 0,
+                "filters": [],
+            }
+        if str(entry.get("priority") or "").strip().lower() in ("1", "true", "yes"):
+            watch["priority"] = 1
+        try:
+            username = _text_field(entry.get("target_username"), "target_username").lstrip("@")
+            if username:
+                watch["target_username"] = username
+
+            for filter_type, filter_value in entry.get("filters", []):
+                filter_type = _text_field(filter_type, "filter type")
+                filter_value = _text_field(filter_value, "filter value")
+                if not filter_type and not filter_value:
+                    continue
+                filter_value = filter_engine.validate_filter(filter_type, filter_value)
+                if (filter_type, filter_value) not in watch["filters"]:
+                    watch["filters"].append((filter_type, filter_value))
+                if filter_type in ("regex_include", "regex_exclude") and sum(
+                    1 for ft, _ in watch["filters"] if ft == filter_type
+                ) > filter_engine.MAX_REGEX_FILTERS:
+                    raise ValueError(f"at most {filter_engine.MAX_REGEX_FILTERS} {filter_type} filters per watch.")
+        except ValueError as e:
+            raise ValueError(f"Entry {line_number}: {e}")
+
+    return list(watches.values())
+
+
+def _text_field(value, name: str) -> str:
+    """Returns a text field stripped of blanks; numbers are accepted as text, anything else is rejected."""
+    if value is None:
+        return ""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"{name} must be text.")
+    return str(value).strip()
+
+
+def _read_csv_entries(text: str) -> list:
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not {"target_user_id", "source_group_id"} <= set(reader.fieldnames):
+        raise ValueError(f"The CSV header must include: {', '.join(CSV_FIELDS)}.")
+    entries = []
+    for row in reader:
+        row["filters"] = [(row.get("filter_type"), row.get("filter_value"))]
+        entries.append(row)
+    return entries
+
+
+def _read_json_entries(text: str) -> list:
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON: {e}")
+    if isinstance(data, dict):
+        data = data.get("watches")
+    if not isinstance(data, list) or not all(isinstance(entry, dict) for entry in data):
+        raise ValueError('The JSON document must be a list of watches or {"watches": [...]}.')
+    for line_number, entry in enumerate(data, start=1):
+        if not isinstance(entry.get("filters") or [], list):
+            raise ValueError(f'Entry {line_number}: "filters" must be a list of {{"type": ..., "value": ...}} objects.')
+        entry["filters"] = [
+            (f.get("type"), f.get("value")) for f in entry.get("filters") or [] if isinstance(f, dict)
+        ]
+    return data
+
+
+def export_watches(targets: list, filters_list: list, file_format: str) -> bytes:
+    """Serializes a user's watches and filters to CSV or JSON, in the format accepted by `parse_import`."""
+    filters_by_target = {}
+    for f in filters_list:
+        filters_by_target.setdefault(f['target_id'], []).append((f['filter_type'], f['filter_value']))
+
+    if file_format == "json":
+        watches = [
+            {
+                "target_user_id": t['target_user_id'],
+                "source_group_id": t['source_group_id'],
+                "target_username": t['target_username'],
+                "priority": t['priority'],
+                "filters": [{"type": ft, "value": fv} for ft, fv in filters_by_target.get(t['id'], [])],
+            }
+            for t in targets
+        ]
+        return json.dumps({"watches": watches}, ensure_ascii=False, indent=2).encode("utf-8")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for t in targets:
+        base = [t['target_user_id'], t['source_group_id'], t['target_username'] or "", t['priority']]
+        target_filters = filters_by_target.get(t['id']) or [("", "")]
+        for filter_type, filter_value in target_filters:
+            writer.writerow(base + [filter_type, filter_value])
+    return buffer.getvalue().encode("utf-8")
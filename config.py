@@ -11,4 +11,39 @@ TELEGRAM_TOKEN = os.environ.get("BOT_TOKEN")
 
 # Leemos la variable de entorno. Si no existe, por defecto será "production".
 # Esto asegura que config.ENVIRONMENT siempre exista.
-ENVIRONMENT = os.environ.get("ENVIRONMENT", "production") 
\ No newline at end of file
+ENVIRONMENT = os.environ.get("ENVIRONMENT", "production") 
+
+# --- Estado de conversaciones y usuarios ---
+# Segundos de inactividad tras los cuales se descarta el estado de un usuario.
+STATE_IDLE_TIMEOUT = int(os.environ.get("STATE_IDLE_TIMEOUT", "900"))
+# Número máximo de usuarios con estado en memoria; los más antiguos se descartan primero.
+STATE_MAX_USERS = int(os.environ.get("STATE_MAX_USERS", "10000"))
+# Segundos que puede quedar abierta una conversación (p. ej. añadir filtro) sin respuesta.
+# Debe ser menor que STATE_IDLE_TIMEOUT.
+CONVERSATION_TIMEOUT = int(os.environ.get("CONVERSATION_TIMEOUT", "300"))
+# Si está activado, el estado de conversaciones sobrevive a los reinicios (guardado en SQLite).
+PERSIST_STATE = os.environ.get("PERSIST_STATE", "false").lower() in ("1", "true", "yes")
+
+# --- Logging ---
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "json" (un objeto por línea, con ids y tiempos por etapa) o "text" (formato clásico).
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+# Cada línea de código puede emitir como máximo LOG_ERROR_BURST warnings/errores cada LOG_ERROR_PERIOD segundos.
+LOG_ERROR_BURST = int(os.environ.get("LOG_ERROR_BURST", "10"))
+LOG_ERROR_PERIOD = int(os.environ.get("LOG_ERROR_PERIOD", "60"))
+
+# --- Álbumes ---
+# Segundos que se esperan para reunir todos los elementos de un álbum antes de reenviarlo.
+ALBUM_COLLECTION_WINDOW = float(os.environ.get("ALBUM_COLLECTION_WINDOW", "1.5"))
+
+# --- Control de admisión ---
+# Mensajes (o álbumes) pendientes de reenviar como máximo; por encima se descartan.
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "1000"))
+# Workers del pipeline; cada uno atiende una fracción de los grupos de origen, en orden de llegada.
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "4"))
+# Cada cuántos segundos se envían los resúmenes acumulados bajo carga alta.
+DIGEST_INTERVAL = int(os.environ.get("DIGEST_INTERVAL", "30"))
+
+# --- Análisis de tokens ---
+# Segundos durante los que se reutiliza el análisis de un token para todos los destinos.
+ANALYSIS_CACHE_TTL = int(os.environ.get("ANALYSIS_CACHE_TTL", "30"))
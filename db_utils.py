@@ -1,7 +1,10 @@
+import logging
 import sqlite3
 
 DB_FILE = "multi_user_bot.db"
 
+logger = logging.getLogger(__name__)
+
 def get_db_connection():
     conn = sqlite3.connect(DB_FILE, check_same_thread=False)
     conn.row_factory = sqlite3.Row
@@ -13,9 +16,13 @@ def create_tables():
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS user_settings (
         user_id INTEGER PRIMARY KEY,
-        destination_chat_id TEXT NOT NULL
+        destination_chat_id TEXT NOT NULL,
+        suspended_reason TEXT -- NULL while the destination accepts messages
     )
     """)
+    columns = [row['name'] for row in cursor.execute("PRAGMA table_info(user_settings)")]
+    if 'suspended_reason' not in columns:
+        cursor.execute("ALTER TABLE user_settings ADD COLUMN suspended_reason TEXT")
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS watched_targets (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -23,29 +30,51 @@ def create_tables():
         source_group_id TEXT NOT NULL,
         target_user_id INTEGER NOT NULL,
         target_username TEXT,
+        priority INTEGER NOT NULL DEFAULT 0, -- 1: still delivered when the bot sheds load
         UNIQUE(watcher_user_id, source_group_id, target_user_id)
     )
     """)
+    columns = [row['name'] for row in cursor.execute("PRAGMA table_info(watched_targets)")]
+    if 'priority' not in columns:
+        cursor.execute("ALTER TABLE watched_targets ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
     
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS filters (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         target_id INTEGER NOT NULL,
-        filter_type TEXT NOT NULL, -- 'keyword_include', 'keyword_exclude', 'content_type'
+        filter_type TEXT NOT NULL, -- see filter_engine.FILTER_TYPES
         filter_value TEXT NOT NULL,
         FOREIGN KEY (target_id) REFERENCES watched_targets (id) ON DELETE CASCADE
     )
     """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_filters_target_id ON filters (target_id)")
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS persisted_user_data (
+        user_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS persisted_conversations (
+        name TEXT NOT NULL,
+        conversation_key TEXT NOT NULL,
+        state INTEGER NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (name, conversation_key)
+    )
+    """)
     
     conn.commit()
     conn.close()
-    print("✅ Base de datos con filtros lista.")
+    logger.info("✅ Base de datos con filtros lista.")
 
 def set_user_destination(user_id: int, destination_chat_id: str):
     conn = get_db_connection()
     conn.execute(
         "INSERT INTO user_settings (user_id, destination_chat_id) VALUES (?, ?) "
-        "ON CONFLICT(user_id) DO UPDATE SET destination_chat_id = excluded.destination_chat_id",
+        "ON CONFLICT(user_id) DO UPDATE SET destination_chat_id = excluded.destination_chat_id, suspended_reason = NULL",
         (user_id, destination_chat_id)
     )
     conn.commit()
@@ -57,18 +86,87 @@ def get_user_destination(user_id: int) -> str | None:
     conn.close()
     return row['destination_chat_id'] if row else None
 
-def add_watched_target(watcher_user_id: int, source_group_id: str, target_user_id: int, target_username: str) -> bool:
+def get_destination_suspension(user_id: int) -> str | None:
+    """Returns why the user's destination was suspended, or None if it is active."""
+    conn = get_db_connection()
+    row = conn.execute("SELECT suspended_reason FROM user_settings WHERE user_id = ?", (user_id,)).fetchone()
+    conn.close()
+    return row['suspended_reason'] if row else None
+
+def suspend_destination(destination_chat_id: str, reason: str) -> list:
+    """Marks a destination as dead for every user delivering to it. Returns the affected user ids."""
+    conn = get_db_connection()
+    with conn:
+        rows = conn.execute(
+            "SELECT user_id FROM user_settings WHERE destination_chat_id = ? AND suspended_reason IS NULL",
+            (destination_chat_id,)
+        ).fetchall()
+        conn.execute(
+            "UPDATE user_settings SET suspended_reason = ? WHERE destination_chat_id = ? AND suspended_reason IS NULL",
+            (reason, destination_chat_id)
+        )
+    conn.close()
+    return [row['user_id'] for row in rows]
+
+def add_watched_target(watcher_user_id: int, source_group_id: str, target_user_id: int, target_username: str) -> int | None:
+    """Returns the id of the new watch, or None if it already existed."""
     try:
         conn = get_db_connection()
-        conn.execute(
+        cursor = conn.execute(
             "INSERT INTO watched_targets (watcher_user_id, source_group_id, target_user_id, target_username) VALUES (?, ?, ?, ?)",
             (watcher_user_id, source_group_id, target_user_id, target_username)
         )
         conn.commit()
         conn.close()
-        return True
+        return cursor.lastrowid
     except sqlite3.IntegrityError:
-        return False
+        return None
+
+def import_watched_targets(watcher_user_id: int, watches: list) -> tuple[list, int, set]:
+    """
+    Inserts many watches and their filters in a single transaction.
+    Each watch is a dict with target_user_id, source_group_id, target_username and filters,
+    a list of (filter_type, filter_value). Existing watches and filters are left untouched.
+    Returns the rows of the newly created watches, the number of filters added and
+    the ids of the watches that were given filters.
+    """
+    conn = get_db_connection()
+    try:
+        with conn:
+            existing_ids = {
+                (row['source_group_id'], row['target_user_id']): row['id']
+                for row in conn.execute(
+                    "SELECT id, source_group_id, target_user_id FROM watched_targets WHERE watcher_user_id = ?",
+                    (watcher_user_id,)
+                )
+            }
+            conn.executemany(
+                "INSERT OR IGNORE INTO watched_targets (watcher_user_id, source_group_id, target_user_id, target_username, priority) VALUES (?, ?, ?, ?, ?)",
+                [(watcher_user_id, w['source_group_id'], w['target_user_id'], w['target_username'], w.get('priority', 0)) for w in watches]
+            )
+            all_targets = conn.execute(
+                "SELECT id, watcher_user_id, source_group_id, target_user_id, priority FROM watched_targets WHERE watcher_user_id = ?",
+                (watcher_user_id,)
+            ).fetchall()
+            ids_by_key = {(row['source_group_id'], row['target_user_id']): row['id'] for row in all_targets}
+            new_targets = [row for row in all_targets if (row['source_group_id'], row['target_user_id']) not in existing_ids]
+
+            filter_rows = [
+                (ids_by_key[(w['source_group_id'], w['target_user_id'])], filter_type, filter_value)
+                for w in watches
+                for filter_type, filter_value in w['filters']
+            ]
+            filtered_target_ids = {row[0] for row in filter_rows}
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT INTO filters (target_id, filter_type, filter_value) SELECT ?1, ?2, ?3 "
+                "WHERE NOT EXISTS (SELECT 1 FROM filters WHERE target_id = ?1 AND filter_type = ?2 AND filter_value = ?3)",
+                filter_rows
+            )
+            filters_added = conn.total_changes - before
+    finally:
+        conn.close()
+    return new_targets, filters_added, filtered_target_ids
 
 def remove_watched_target_by_id(target_id: int) -> bool:
     conn = get_db_connection()
@@ -79,20 +177,33 @@ def remove_watched_target_by_id(target_id: int) -> bool:
     conn.close()
     return changes > 0
 
+def get_all_watched_targets() -> list:
+    conn = get_db_connection()
+    # Los watches de destinos suspendidos no se enrutan.
+    targets = conn.execute(
+        "SELECT w.id, w.watcher_user_id, w.source_group_id, w.target_user_id, w.priority FROM watched_targets w "
+        "LEFT JOIN user_settings s ON s.user_id = w.watcher_user_id WHERE s.suspended_reason IS NULL"
+    ).fetchall()
+    conn.close()
+    return targets
+
 def get_user_watched_targets(watcher_user_id: int) -> list:
     conn = get_db_connection()
-    targets = conn.execute("SELECT id, source_group_id, target_user_id, target_username FROM watched_targets WHERE watcher_user_id = ?", (watcher_user_id,)).fetchall()
+    targets = conn.execute("SELECT id, source_group_id, target_user_id, target_username, priority FROM watched_targets WHERE watcher_user_id = ?", (watcher_user_id,)).fetchall()
     conn.close()
     return targets
 
-def find_watchers_for_target(source_group_id: str, target_user_id: int) -> list:
+def get_watched_target(target_id: int):
     conn = get_db_connection()
-    watchers = conn.execute(
-        "SELECT id, watcher_user_id FROM watched_targets WHERE source_group_id = ? AND target_user_id = ?",
-        (source_group_id, str(target_user_id))
-    ).fetchall()
+    target = conn.execute("SELECT id, watcher_user_id, source_group_id, target_user_id, target_username, priority FROM watched_targets WHERE id = ?", (target_id,)).fetchone()
+    conn.close()
+    return target
+
+def set_watch_priority(target_id: int, priority: int):
+    conn = get_db_connection()
+    conn.execute("UPDATE watched_targets SET priority = ? WHERE id = ?", (priority, target_id))
+    conn.commit()
     conn.close()
-    return watchers
 
 def add_filter(target_id: int, filter_type: str, filter_value: str):
     conn = get_db_connection()
@@ -103,12 +214,31 @@ def add_filter(target_id: int, filter_type: str, filter_value: str):
     conn.commit()
     conn.close()
 
+def add_filters(target_id: int, filter_type: str, filter_values: list):
+    conn = get_db_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO filters (target_id, filter_type, filter_value) VALUES (?, ?, ?)",
+            [(target_id, filter_type, value) for value in filter_values]
+        )
+    conn.close()
+
 def get_filters_for_target(target_id: int) -> list:
     conn = get_db_connection()
     filters_list = conn.execute("SELECT id, filter_type, filter_value FROM filters WHERE target_id = ?", (target_id,)).fetchall()
     conn.close()
     return filters_list
 
+def get_user_filters(watcher_user_id: int) -> list:
+    conn = get_db_connection()
+    filters_list = conn.execute(
+        "SELECT f.target_id, f.filter_type, f.filter_value FROM filters f "
+        "JOIN watched_targets w ON w.id = f.target_id WHERE w.watcher_user_id = ?",
+        (watcher_user_id,)
+    ).fetchall()
+    conn.close()
+    return filters_list
+
 def remove_filter_by_id(filter_id: int):
     conn = get_db_connection()
     conn.execute("DELETE FROM filters WHERE id = ?", (filter_id,))
@@ -129,6 +259,62 @@ def update_migrated_group_id(old_group_id: str, new_group_id: str):
         "UPDATE watched_targets SET source_group_id = ? WHERE source_group_id = ?",
         (new_group_id, old_group_id)
     )
+    cur.execute(
+        "UPDATE user_settings SET destination_chat_id = ? WHERE destination_chat_id = ?",
+        (new_group_id, old_group_id)
+    )
+    conn.commit()
+    conn.close()
+    logger.info("Database updated: group migrated", extra={'old_chat_id': old_group_id, 'new_chat_id': new_group_id})
+
+# --- Persistencia del estado de conversaciones ---
+
+def get_persisted_user_data(min_updated_at: float) -> list:
+    """Returns the stored user_data rows touched after `min_updated_at`, pruning older ones."""
+    conn = get_db_connection()
+    conn.execute("DELETE FROM persisted_user_data WHERE updated_at < ?", (min_updated_at,))
+    conn.commit()
+    rows = conn.execute("SELECT user_id, data FROM persisted_user_data").fetchall()
+    conn.close()
+    return rows
+
+def save_persisted_user_data(user_id: int, data: str, updated_at: float):
+    conn = get_db_connection()
+    conn.execute(
+        "INSERT INTO persisted_user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+        (user_id, data, updated_at)
+    )
+    conn.commit()
+    conn.close()
+
+def remove_persisted_user_data(user_id: int):
+    conn = get_db_connection()
+    conn.execute("DELETE FROM persisted_user_data WHERE user_id = ?", (user_id,))
+    conn.commit()
+    conn.close()
+
+def get_persisted_conversations(name: str, min_updated_at: float) -> list:
+    """Returns the stored states of a conversation handler, pruning abandoned ones."""
+    conn = get_db_connection()
+    conn.execute("DELETE FROM persisted_conversations WHERE name = ? AND updated_at < ?", (name, min_updated_at))
+    conn.commit()
+    rows = conn.execute("SELECT conversation_key, state FROM persisted_conversations WHERE name = ?", (name,)).fetchall()
+    conn.close()
+    return rows
+
+def save_persisted_conversation(name: str, conversation_key: str, state: int, updated_at: float):
+    conn = get_db_connection()
+    conn.execute(
+        "INSERT INTO persisted_conversations (name, conversation_key, state, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(name, conversation_key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+        (name, conversation_key, state, updated_at)
+    )
+    conn.commit()
+    conn.close()
+
+def remove_persisted_conversation(name: str, conversation_key: str):
+    conn = get_db_connection()
+    conn.execute("DELETE FROM persisted_conversations WHERE name = ? AND conversation_key = ?", (name, conversation_key))
     conn.commit()
     conn.close()
-    print(f"Database updated: Group ID {old_group_id} migrated to {new_group_id}")
\ No newline at end of file
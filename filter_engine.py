@@ -0,0 +1,290 @@
+import logging
+import re
+
+try:
+    # google-re2: motor de regex de tiempo lineal, inmune al backtracking catastrófico.
+    # Es obligatorio: con el motor `re` de la stdlib, hasta una sola repetición como `a*b`
+    # es cuadrática y las regex de un usuario podrían bloquear el bot para todos.
+    import re2
+except ImportError as e:
+    raise ImportError("google-re2 is required for regex filters: pip install google-re2") from e
+
+import db_utils
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {"image", "video", "link", "text_only", "solana_ca", "contract_address"}
+FILTER_TYPES = {
+    "keyword_include", "keyword_exclude", "content_type",
+    "phrase_include", "phrase_exclude", "regex_include", "regex_exclude", "boolean",
+}
+
+MAX_PATTERN_LENGTH = 200
+# Las regex de un watch se combinan en un único autómata; más allá de esto re2 se queda sin memoria de DFA.
+MAX_REGEX_FILTERS = 100
+MAX_BOOLEAN_LENGTH = 500
+# Memoria máxima de cada regex compilada (programa + caché del DFA). También acota el tiempo de
+# compilación: con 32 MB, 100 patrones como `\w{1,100}\w{1,100}...` tardan minutos en fallar.
+REGEX_MAX_MEM = 8 << 20
+
+_RE2_OPTIONS = re2.Options()
+# Los errores se devuelven como excepción; sin esto re2 los escribe directamente en stderr.
+_RE2_OPTIONS.log_errors = False
+_RE2_OPTIONS.max_mem = REGEX_MAX_MEM
+
+_TOKEN_RE = re.compile(r"\w+")
+_BOOLEAN_TOKEN_RE = re.compile(r'\s*(\(|\)|"[^"]*"|[^\s()"]+)')
+_BOOLEAN_OPERATORS = {"AND", "OR", "NOT"}
+
+
+def tokenize(text: str) -> tuple:
+    return tuple(_TOKEN_RE.findall(text.lower()))
+
+
+class PreparedText:
+    """A message text normalized once and shared by every watch it is evaluated against."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.lower = text.lower()
+        self.tokens = tuple(_TOKEN_RE.findall(self.lower))
+        self._ngrams = {}
+
+    def ngrams(self, n: int) -> set:
+        """Set of the consecutive word sequences of length n in the text (cached)."""
+        grams = self._ngrams.get(n)
+        if grams is None:
+            tokens = self.tokens
+            grams = self._ngrams[n] = {tokens[i:i + n] for i in range(len(tokens) - n + 1)}
+        return grams
+
+    def has_phrase(self, phrase: tuple) -> bool:
+        return phrase in self.ngrams(len(phrase))
+
+
+class PhraseSet:
+    """Whole-word phrases grouped by length; matching costs one set lookup per distinct length."""
+
+    def __init__(self, phrases: list):
+        self.by_length = {}
+        for phrase in phrases:
+            self.by_length.setdefault(len(phrase), set()).add(phrase)
+
+    def __bool__(self) -> bool:
+        return bool(self.by_length)
+
+    def matches(self, text: PreparedText) -> bool:
+        return any(not text.ngrams(n).isdisjoint(phrases) for n, phrases in self.by_length.items())
+
+
+# --- Validación ---
+
+def validate_filter(filter_type: str, filter_value: str) -> str:
+    """Checks a filter before it is stored and returns its normalized value. Raises ValueError."""
+    if filter_type not in FILTER_TYPES:
+        raise ValueError(f"Unknown filter type '{filter_type}'.")
+    value = filter_value.strip()
+    if not value:
+        raise ValueError("The filter value is empty.")
+
+    if filter_type == "content_type":
+        if value.lower() not in CONTENT_TYPES:
+            raise ValueError(f"Unknown content type '{value}'.")
+        return value.lower()
+    if filter_type in ("phrase_include", "phrase_exclude"):
+        if len(value) > MAX_PATTERN_LENGTH or not tokenize(value):
+            raise ValueError(f"'{value}' is not a valid phrase.")
+        return " ".join(tokenize(value))
+    if filter_type in ("regex_include", "regex_exclude"):
+        if _compile_regex([value]).groupindex:
+            raise ValueError("Named groups such as (?P<name>...) are not supported in regex filters; use (?:...) instead.")
+        return value
+    if filter_type == "boolean":
+        if len(value) > MAX_BOOLEAN_LENGTH:
+            raise ValueError(f"The expression is too long (max {MAX_BOOLEAN_LENGTH} characters).")
+        parse_boolean(value)
+        return value
+    return value.lower()
+
+
+def _compile_regex(patterns: list):
+    """Compiles several patterns into a single case-insensitive alternation."""
+    for pattern in patterns:
+        if len(pattern) > MAX_PATTERN_LENGTH:
+            raise ValueError(f"Regex is too long (max {MAX_PATTERN_LENGTH} characters).")
+    combined = "(?i)" + "|".join(f"(?:{pattern})" for pattern in patterns)
+    try:
+        return re2.compile(combined, _RE2_OPTIONS)
+    except re2.error as e:
+        message = e.args[0].decode(errors="replace") if e.args and isinstance(e.args[0], bytes) else e
+        raise ValueError(f"Invalid regex: {message}")
+
+
+# --- Expresiones booleanas ---
+
+def parse_boolean(expression: str):
+    """
+    Parses `btc AND ("new listing" OR pump) AND NOT scam` into a tree of
+    ('term', phrase), ('not', node), ('and', [nodes]) and ('or', [nodes]).
+    Adjacent terms are joined with AND. Raises ValueError on bad syntax.
+    """
+    tokens = _BOOLEAN_TOKEN_RE.findall(expression)
+    node, position = _parse_or(tokens, 0)
+    if position != len(tokens):
+        raise ValueError(f"Unexpected '{tokens[position]}' in boolean expression.")
+    return node
+
+
+def _parse_or(tokens: list, position: int):
+    nodes = []
+    node, position = _parse_and(tokens, position)
+    nodes.append(node)
+    while position < len(tokens) and tokens[position] == "OR":
+        node, position = _parse_and(tokens, position + 1)
+        nodes.append(node)
+    return (nodes[0] if len(nodes) == 1 else ("or", nodes)), position
+
+
+def _parse_and(tokens: list, position: int):
+    nodes = []
+    node, position = _parse_not(tokens, position)
+    nodes.append(node)
+    while position < len(tokens) and tokens[position] not in ("OR", ")"):
+        if tokens[position] == "AND":
+            position += 1
+        node, position = _parse_not(tokens, position)
+        nodes.append(node)
+    return (nodes[0] if len(nodes) == 1 else ("and", nodes)), position
+
+
+def _parse_not(tokens: list, position: int):
+    if position >= len(tokens):
+        raise ValueError("Incomplete boolean expression.")
+    token = tokens[position]
+    if token == "NOT":
+        node, position = _parse_not(tokens, position + 1)
+        return ("not", node), position
+    if token == "(":
+        node, position = _parse_or(tokens, position + 1)
+        if position >= len(tokens) or tokens[position] != ")":
+            raise ValueError("Missing ')' in boolean expression.")
+        return node, position + 1
+    if token == ")" or token in _BOOLEAN_OPERATORS:
+        raise ValueError(f"Unexpected '{token}' in boolean expression.")
+    phrase = tokenize(token.strip('"'))
+    if not phrase:
+        raise ValueError(f"'{token}' is not a valid term.")
+    return ("term", phrase), position + 1
+
+
+def evaluate_boolean(node, text: PreparedText) -> bool:
+    kind, value = node
+    if kind == "term":
+        return text.has_phrase(value)
+    if kind == "not":
+        return not evaluate_boolean(value, text)
+    if kind == "and":
+        return all(evaluate_boolean(child, text) for child in value)
+    return any(evaluate_boolean(child, text) for child in value)
+
+
+# --- Filtros compilados por watch ---
+
+class CompiledFilters:
+    """All the filters of one watch, compiled once and reused for every message."""
+
+    def __init__(self, filters: list):
+        values_by_type = {}
+        for f in filters:
+            values_by_type.setdefault(f['filter_type'], []).append(f['filter_value'])
+
+        self.has_filters = bool(filters)
+        self.include_keywords = values_by_type.get("keyword_include", [])
+        self.exclude_keywords = values_by_type.get("keyword_exclude", [])
+        self.content_types = values_by_type.get("content_type", [])
+        self.include_phrases = PhraseSet([tokenize(v) for v in values_by_type.get("phrase_include", [])])
+        self.exclude_phrases = PhraseSet([tokenize(v) for v in values_by_type.get("phrase_exclude", [])])
+        self.include_regex = _compile_stored_regex(values_by_type.get("regex_include", []))
+        self.exclude_regex = _compile_stored_regex(values_by_type.get("regex_exclude", []))
+        self.boolean_expressions = []
+        for expression in values_by_type.get("boolean", []):
+            try:
+                self.boolean_expressions.append(parse_boolean(expression))
+            except ValueError as e:
+                logger.warning(f"Skipping invalid boolean filter {expression!r}: {e}")
+        self.has_text_includes = bool(self.include_keywords or self.include_phrases or self.include_regex)
+
+    def __bool__(self) -> bool:
+        return self.has_filters
+
+    def matches_text(self, text: PreparedText) -> bool:
+        """Applies the text filters: any exclude rejects, at least one include must match, every boolean must hold."""
+        if any(keyword in text.lower for keyword in self.exclude_keywords):
+            return False
+        if self.exclude_phrases and self.exclude_phrases.matches(text):
+            return False
+        if self.exclude_regex and self.exclude_regex.search(text.text):
+            return False
+
+        if self.has_text_includes and not (
+            any(keyword in text.lower for keyword in self.include_keywords)
+            or (self.include_phrases and self.include_phrases.matches(text))
+            or (self.include_regex and self.include_regex.search(text.text))
+        ):
+            return False
+
+        return all(evaluate_boolean(expression, text) for expression in self.boolean_expressions)
+
+
+def _compile_stored_regex(patterns: list):
+    if len(patterns) > MAX_REGEX_FILTERS:
+        logger.warning(f"Only the first {MAX_REGEX_FILTERS} of {len(patterns)} regex filters are used.")
+        patterns = patterns[:MAX_REGEX_FILTERS]
+    valid_patterns = []
+    for pattern in patterns:
+        try:
+            _compile_regex([pattern])
+            valid_patterns.append(pattern)
+        except ValueError as e:
+            logger.warning(f"Skipping regex filter {pattern!r}: {e}")
+    if not valid_patterns:
+        return None
+    try:
+        return _compile_regex(valid_patterns)
+    except ValueError as e:
+        # Cada patrón es válido por separado pero la alternativa combinada no compila
+        # (p. ej. el programa combinado supera REGEX_MAX_MEM).
+        logger.warning(f"Could not combine {len(valid_patterns)} regex filters, matching them one by one: {e}")
+        return RegexList([_compile_regex([pattern]) for pattern in valid_patterns])
+
+
+class RegexList:
+    """Fallback for patterns that cannot be combined into one alternation: searches them in turn."""
+
+    def __init__(self, regexes: list):
+        self.regexes = regexes
+
+    def search(self, text: str):
+        for regex in self.regexes:
+            match = regex.search(text)
+            if match:
+                return match
+        return None
+
+
+_compiled_by_target: dict[int, CompiledFilters] = {}
+
+
+def get_compiled_filters(target_id: int) -> CompiledFilters:
+    compiled = _compiled_by_target.get(target_id)
+    if compiled is None:
+        compiled = _compiled_by_target[target_id] = CompiledFilters(db_utils.get_filters_for_target(target_id))
+    return compiled
+
+
+def invalidate(target_id: int | None = None):
+    """Forgets the compiled filters of a watch (or of every watch) after they change."""
+    if target_id is None:
+        _compiled_by_target.clear()
+    else:
+        _compiled_by_target.pop(int(target_id), None)
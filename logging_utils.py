@@ -0,0 +1,132 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import config
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Atributos propios de LogRecord; todo lo demás llega vía `extra=` y se serializa como campo.
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the `extra=` fields (chat_id, target_id, timings...) as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `burst` records per call site every `period` seconds
+    for levels >= `min_level`. The next record that passes carries a
+    `suppressed` field with the number of records dropped in between.
+    """
+
+    def __init__(self, burst: int, period: float, min_level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.min_level = min_level
+        self._windows = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.period:
+            suppressed = window[2] if window else 0
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that only resolves the message text before enqueueing. The stock
+    prepare() formats the whole record (traceback included) on the calling thread
+    and drops exc_info; here exc_info travels with the record and is formatted by
+    the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging():
+    """
+    Sends every log record through a queue so that handlers never block the
+    event loop: the loop only enqueues, and a background thread formats and
+    writes to stderr.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(burst=config.LOG_ERROR_BURST, period=config.LOG_ERROR_PERIOD))
+
+    stream_handler = logging.StreamHandler()
+    if config.LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(config.LOG_LEVEL)
+    # httpx registra cada petición a la API de Telegram (incluido el polling) a nivel INFO,
+    # y apscheduler cada ejecución de los jobs (uno por álbum).
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class StageTimer:
+    """Accumulates the time spent in each stage of a handler, in milliseconds."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name: str, ms: float):
+        self.timings[name] = self.timings.get(name, 0.0) + ms
+
+    def as_dict(self) -> dict:
+        return {name: round(ms, 2) for name, ms in self.timings.items()}
@@ -1,7 +1,10 @@
 # main.py (Version 6.0 - Final with Token Analysis)
 
+import asyncio
+import datetime
 import logging
 import re
+import time
 import base58
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -12,22 +15,139 @@ from telegram.ext import (
     ContextTypes,
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
 )
 from telegram.constants import ParseMode
-from telegram.error import BadRequest
+from telegram.error import BadRequest, ChatMigrated, Forbidden, RetryAfter, TelegramError
 
 import config
 import db_utils
-import api_client
-
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+import admission
+import bulk_io
+import filter_engine
+import logging_utils
+import rendering
+import routing
+import state_store
+
+# Enable logging (non-blocking: records are written by a background thread)
+logging_utils.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Conversation states
-SELECTING_FILTER_TYPE, AWAITING_KEYWORD_INCLUDE, AWAITING_KEYWORD_EXCLUDE, AWAITING_CONTENT_TYPE = range(4)
+SELECTING_FILTER_TYPE, AWAITING_KEYWORD_INCLUDE, AWAITING_KEYWORD_EXCLUDE, AWAITING_CONTENT_TYPE, AWAITING_PATTERN = range(5)
+
+PATTERN_FILTER_PROMPTS = {
+    'phrase_include': "Send the phrases or whole words to require, one per line (e.g. `new listing`). Only complete words match.",
+    'phrase_exclude': "Send the phrases or whole words to exclude, one per line (e.g. `giveaway`). Only complete words match.",
+    'regex_include': "Send the regular expressions to require, one per line (e.g. `\\bpump(ed)?\\b`). Matching ignores case.",
+    'regex_exclude': "Send the regular expressions to exclude, one per line. Matching ignores case.",
+    'boolean': 'Send a boolean expression with AND, OR, NOT and parentheses. Quote phrases, e.g. `btc AND ("new listing" OR pump) AND NOT scam`.',
+}
+
+# Users with conversation state in memory; idle or excess entries are dropped from user_data.
+USER_STATE = state_store.ExpiringStore(maxsize=config.STATE_MAX_USERS, ttl=config.STATE_IDLE_TIMEOUT)
+
+# Fragmentos de BadRequest que indican que el destino no volverá a aceptar mensajes.
+# CHAT_WRITE_FORBIDDEN no está: suele ser un silencio o una restricción temporal del bot.
+PERMANENT_BAD_REQUESTS = (
+    "chat not found",
+    "peer_id_invalid",
+    "group chat was deactivated",
+    "bot is not a member",
+    "bot was kicked",
+)
+SUSPENSION_REASONS = {
+    "forbidden": "I was removed from the chat or blocked there",
+    "chat_not_found": "the chat no longer exists or I can no longer see it",
+}
+
+# (chat_id, media_group_id) -> album items received during the collection window.
+PENDING_ALBUMS: dict[tuple, dict] = {}
+# chat_id -> work waiting behind an album of that chat that is still being collected, in arrival
+# order. Each entry is {'messages', 'watchers', 'timer', 'ready'}; albums become ready when flushed.
+PENDING_BY_CHAT: dict[int, list] = {}
+
+# Bounded queue between group_message_handler and the workers that forward messages.
+ADMISSION = admission.AdmissionController(maxsize=config.PIPELINE_QUEUE_SIZE, shards=config.PIPELINE_WORKERS)
+# Telegram admite como máximo 10 elementos por álbum.
+ALBUM_MAX_ITEMS = 10
+
+# destination_chat_id -> digest lines collected while the bot is under heavy load.
+PENDING_DIGESTS: dict[str, list] = {}
+DIGEST_OVERFLOW: dict[str, int] = {}
+DIGEST_MAX_LINES = 12
+
+# user_id -> username resolved with get_chat, shared by /watch and /import.
+USERNAME_CACHE = state_store.ExpiringStore(maxsize=50_000, ttl=6 * 3600)
+USERNAME_LOOKUP_CONCURRENCY = 20
+USERNAME_LOOKUP_RETRIES = 3
+# Instante (loop.time()) hasta el que Telegram nos pidió esperar; todas las búsquedas lo respetan.
+_username_lookups_paused_until = 0.0
+
+
+# --- Conversation State Helpers ---
+
+def remember_user_state(context: ContextTypes.DEFAULT_TYPE, user_id: int, **values):
+    """Stores conversation values in user_data and refreshes the user's idle timer."""
+    context.user_data.update(values)
+    for evicted_user_id in USER_STATE.set(user_id):
+        context.application.drop_user_data(evicted_user_id)
+
+
+def forget_user_state(context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    """Drops all the conversation state kept for a user."""
+    USER_STATE.pop(user_id)
+    context.application.drop_user_data(user_id)
+
+
+async def prune_idle_state(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job: drops the state of users who abandoned a conversation."""
+    application = context.application
+    for user_id in USER_STATE.prune():
+        application.drop_user_data(user_id)
+    # Con persistencia, PTB crea un user_data vacío para cada usuario que envía cualquier update
+    # (p. ej. cada miembro de los grupos vigilados); esas entradas no pasan por USER_STATE.
+    for user_id in [user_id for user_id, data in application.user_data.items() if not data]:
+        if user_id not in USER_STATE:
+            application.drop_user_data(user_id)
+
+
+async def conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    forget_user_state(context, update.effective_user.id)
+
+
+async def expired_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ends a conversation whose state was already dropped (idle expiry or a restart)."""
+    forget_user_state(context, update.effective_user.id)
+    text = "⌛ This action has expired. Please start again from /list."
+    if update.callback_query:
+        await update.callback_query.answer(text=text, show_alert=True)
+    else:
+        await update.message.reply_text(text)
+    return ConversationHandler.END
+
+
+async def post_init(application: Application):
+    routing.load()
+    # Los workers se crean cuando la aplicación ya está en marcha para que Application.stop() espere
+    # a que vacíen sus colas.
+    application.job_queue.run_once(start_pipeline_workers, 0)
+
+    # El estado restaurado desde la persistencia también debe poder expirar.
+    for user_id in list(application.user_data):
+        for evicted_user_id in USER_STATE.set(user_id):
+            application.drop_user_data(evicted_user_id)
+
+
+async def start_pipeline_workers(context: ContextTypes.DEFAULT_TYPE):
+    application = context.application
+    for shard in range(len(ADMISSION.queues)):
+        application.create_task(
+            ADMISSION.run_worker(shard, process_work_item, running=lambda: application.running),
+            name=f"pipeline_worker_{shard}",
+        )
+
 
 # --- Command Handlers ---
 
@@ -66,10 +186,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def set_destination(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
     user_id = update.effective_user.id
     chat = update.effective_chat
     db_utils.set_user_destination(user_id, str(chat.id))
+    routing.add_watcher(user_id)
     await update.message.reply_text(f"✅ Destination set! Alerts will be forwarded to '{chat.title}'.")
     try:
         await context.bot.send_message(
@@ -104,11 +224,13 @@ async def get_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def watch(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
     watcher_user_id = update.effective_user.id
     if not db_utils.get_user_destination(watcher_user_id):
         await update.message.reply_text("⚠️ Please set your destination chat first with `/set_destination`.")
         return
+    if db_utils.get_destination_suspension(watcher_user_id):
+        await update.message.reply_text("⚠️ Your destination is suspended because I can't deliver there. Send `/set_destination` in a chat where I can post.")
+        return
     try:
         target_user_id = int(context.args[0])
         source_group_id = str(context.args[1])
@@ -116,21 +238,155 @@ async def watch(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Incorrect format. Use: `/watch <USER_ID> <GROUP_ID>`")
         return
     try:
-        target_user_info = await context.bot.get_chat(target_user_id)
-        target_username = target_user_info.username or f"User_{target_user_id}"
-    except BadRequest:
+        target_username = await resolve_username(context.bot, target_user_id)
+    except TelegramError as e:
+        logger.warning(f"Could not resolve user {target_user_id}: {e}")
+        await update.message.reply_text("⚠️ Telegram is busy right now, please try again in a minute.")
+        return
+    if not target_username:
         await update.message.reply_text("❌ Error: I could not find that User ID.")
         return
-    if db_utils.add_watched_target(watcher_user_id, source_group_id, target_user_id, target_username):
+    target_id = db_utils.add_watched_target(watcher_user_id, source_group_id, target_user_id, target_username)
+    if target_id:
+        routing.add_target(target_id, watcher_user_id, source_group_id, target_user_id)
         await update.message.reply_text(f"✅ Watch activated for @{target_username}.")
     else:
         await update.message.reply_text(f"ℹ️ You are already watching @{target_username} in that group.")
 
 
+async def resolve_username(bot, user_id: int) -> str | None:
+    """
+    Returns the username of a user (cached), or None if the user does not exist.
+    Flood limits (RetryAfter) pause every lookup and are retried; any other
+    transient failure is raised so that no placeholder name gets stored.
+    """
+    global _username_lookups_paused_until
+    username = USERNAME_CACHE.get(user_id)
+    if username:
+        return username
+    loop = asyncio.get_running_loop()
+    for attempt in range(USERNAME_LOOKUP_RETRIES + 1):
+        delay = _username_lookups_paused_until - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            target_user_info = await bot.get_chat(user_id)
+            break
+        except BadRequest:
+            return None
+        except RetryAfter as e:
+            if attempt == USERNAME_LOOKUP_RETRIES:
+                raise
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, datetime.timedelta) else e.retry_after
+            _username_lookups_paused_until = max(_username_lookups_paused_until, loop.time() + retry_after)
+    username = target_user_info.username or f"User_{user_id}"
+    USERNAME_CACHE.set(user_id, username)
+    return username
+
+
+async def resolve_usernames(bot, user_ids: list) -> tuple[dict, set]:
+    """
+    Resolves many usernames concurrently, with at most USERNAME_LOOKUP_CONCURRENCY calls in flight.
+    Returns the usernames (None for users that do not exist) and the ids that could not be looked up.
+    """
+    semaphore = asyncio.Semaphore(USERNAME_LOOKUP_CONCURRENCY)
+    usernames, failed = {}, set()
+
+    async def lookup(user_id: int):
+        async with semaphore:
+            try:
+                usernames[user_id] = await resolve_username(bot, user_id)
+            except TelegramError as e:
+                logger.warning(f"Could not resolve user {user_id}: {e}")
+                failed.add(user_id)
+
+    await asyncio.gather(*(lookup(user_id) for user_id in set(user_ids)))
+    return usernames, failed
+
+
+async def import_watchlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Imports watches and filters from a CSV/JSON document sent with (or replied to with) /import."""
+    watcher_user_id = update.effective_user.id
+    message = update.effective_message
+    if not db_utils.get_user_destination(watcher_user_id):
+        await message.reply_text("⚠️ Please set your destination chat first with `/set_destination`.")
+        return
+    if db_utils.get_destination_suspension(watcher_user_id):
+        await message.reply_text("⚠️ Your destination is suspended because I can't deliver there. Send `/set_destination` in a chat where I can post.")
+        return
+
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    if not document:
+        await message.reply_text(
+            "Send a CSV or JSON file with the caption `/import`, or reply to one with `/import`.\n"
+            f"CSV columns: {', '.join(bulk_io.CSV_FIELDS)}.\n"
+            "Use /export to get a file in the expected format."
+        )
+        return
+    if document.file_size and document.file_size > bulk_io.MAX_IMPORT_BYTES:
+        await message.reply_text("❌ Import failed: the file is too large.")
+        return
+
+    file = await document.get_file()
+    raw = bytes(await file.download_as_bytearray())
+    try:
+        watches = bulk_io.parse_import(raw, document.file_name or "")
+    except ValueError as e:
+        await message.reply_text(f"❌ Import failed: {e}")
+        return
+
+    missing = [w['target_user_id'] for w in watches if not w['target_username']]
+    failed = set()
+    if missing:
+        await message.reply_text(f"🔍 Resolving {len(set(missing))} user(s)...")
+        usernames, failed = await resolve_usernames(context.bot, missing)
+        for w in watches:
+            if not w['target_username']:
+                w['target_username'] = usernames.get(w['target_user_id'])
+    valid_watches = [w for w in watches if w['target_username']]
+    failed_watches = sum(1 for w in watches if w['target_user_id'] in failed and not w['target_username'])
+
+    new_targets, filters_added, filtered_target_ids = db_utils.import_watched_targets(watcher_user_id, valid_watches)
+    routing.add_targets(new_targets)
+    for target_id in filtered_target_ids:
+        filter_engine.invalidate(target_id)
+
+    summary = (
+        f"✅ Import finished.\n\n"
+        f"• New watches: {len(new_targets)}\n"
+        f"• Already watched: {len(valid_watches) - len(new_targets)}\n"
+        f"• Filters added: {filters_added}"
+    )
+    if len(valid_watches) + failed_watches < len(watches):
+        summary += f"\n• Skipped (user not found): {len(watches) - len(valid_watches) - failed_watches}"
+    if failed_watches:
+        summary += f"\n• Skipped (Telegram busy, import the file again later): {failed_watches}"
+    await message.reply_text(summary)
+
+
+async def export_watchlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sends the user's watches and filters as a CSV (default) or JSON document."""
+    watcher_user_id = update.effective_user.id
+    file_format = context.args[0].lower() if context.args else "csv"
+    if file_format not in ("csv", "json"):
+        await update.message.reply_text("Incorrect format. Use: `/export [csv|json]`")
+        return
+
+    targets = db_utils.get_user_watched_targets(watcher_user_id)
+    if not targets:
+        await update.message.reply_text("Your watchlist is empty.")
+        return
+    data = bulk_io.export_watches(targets, db_utils.get_user_filters(watcher_user_id), file_format)
+    await update.message.reply_document(
+        document=data,
+        filename=f"watchlist.{file_format}",
+        caption=f"🎯 {len(targets)} watch(es). Send this file back with /import to restore it."
+    )
+
+
 # --- UI and Menu Handlers ---
 
 async def list_targets(update: Update, context: ContextTypes.DEFAULT_TYPE, is_callback: bool = False):
-    # ... (Sin cambios)
     user_id = update.effective_user.id
     query = update.callback_query
     
@@ -143,7 +399,8 @@ async def list_targets(update: Update, context: ContextTypes.DEFAULT_TYPE, is_ca
         keyboard.append([InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="back_to_start")])
     else:
         for target in targets:
-            message_text += f"👤 @{target['target_username']} in group <code>{target['source_group_id']}</code>\n"
+            priority_mark = "⭐ " if target['priority'] else ""
+            message_text += f"{priority_mark}👤 @{target['target_username']} in group <code>{target['source_group_id']}</code>\n"
             buttons = [
                 InlineKeyboardButton("⚙️ Manage Filters", callback_data=f"manage:{target['id']}"),
                 InlineKeyboardButton("🗑️ Stop Watching", callback_data=f"stop:{target['id']}")
@@ -159,7 +416,6 @@ async def list_targets(update: Update, context: ContextTypes.DEFAULT_TYPE, is_ca
 
 
 async def destination_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
     query = update.callback_query
     user_id = update.effective_user.id
     destination_chat_id = db_utils.get_user_destination(user_id)
@@ -167,6 +423,12 @@ async def destination_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message_text = "<b>⚙️ Destination Management</b>\n\n"
     keyboard = []
     if destination_chat_id:
+        suspended_reason = db_utils.get_destination_suspension(user_id)
+        if suspended_reason:
+            message_text += (
+                f"⚠️ <b>Suspended:</b> {SUSPENSION_REASONS.get(suspended_reason, suspended_reason)}.\n"
+                "Your watches are paused. Send <code>/set_destination</code> in a chat where I can post to resume.\n\n"
+            )
         try:
             chat_info = await context.bot.get_chat(destination_chat_id)
             message_text += f"Current destination: '<b>{chat_info.title}</b>'."
@@ -182,7 +444,6 @@ async def destination_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def manage_filters_menu(query: Update.callback_query, context: ContextTypes.DEFAULT_TYPE, target_id: int):
-    # ... (Sin cambios)
     filters = db_utils.get_filters_for_target(target_id)
     
     message_text = "<b>Managing Filters:</b>\n\n"
@@ -192,9 +453,17 @@ async def manage_filters_menu(query: Update.callback_query, context: ContextType
         for f in filters:
             message_text += f"• <code>{f['filter_type']}: {f['filter_value']}</code>\n"
     
+    target = db_utils.get_watched_target(target_id)
+    if target and target['priority']:
+        message_text += "\n\n⭐ <i>Priority watch: delivered in real time even when the bot is overloaded.</i>"
+        priority_button = InlineKeyboardButton("☆ Remove Priority", callback_data=f"priority:{target_id}:0")
+    else:
+        priority_button = InlineKeyboardButton("⭐ Mark as Priority", callback_data=f"priority:{target_id}:1")
+
     keyboard = [
         [InlineKeyboardButton("➕ Add Filter", callback_data=f"add_filter:{target_id}")],
         [InlineKeyboardButton("➖ Remove Filter", callback_data=f"remove_filter_menu:{target_id}")],
+        [priority_button],
         [InlineKeyboardButton("⬅️ Back to List", callback_data="show_list")]
     ]
     await query.edit_message_text(
@@ -205,7 +474,6 @@ async def manage_filters_menu(query: Update.callback_query, context: ContextType
 
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
     query = update.callback_query
     await query.answer()
     
@@ -239,12 +507,23 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     elif action == "stop":
         db_utils.remove_watched_target_by_id(int(value))
+        routing.remove_target(int(value))
+        filter_engine.invalidate(int(value))
         await list_targets(update, context, is_callback=True)
 
     elif action == "manage":
         await manage_filters_menu(query, context, int(value))
+
+    elif action == "priority":
+        target_id_str, _, priority_str = value.partition(':')
+        target_id, priority = int(target_id_str), int(priority_str)
+        db_utils.set_watch_priority(target_id, priority)
+        routing.set_priority(target_id, priority)
+        await manage_filters_menu(query, context, target_id)
     
     elif action == "stop_watch":
+        routing.remove_target(int(value))
+        filter_engine.invalidate(int(value))
         if db_utils.remove_watched_target_by_id(int(value)):
             await query.edit_message_text(f"{query.message.text}\n\n<b>✅ Watch removed.</b>", parse_mode=ParseMode.HTML, reply_markup=None)
         else:
@@ -252,14 +531,18 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def add_filter_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
     query = update.callback_query
     await query.answer()
     target_id = query.data.split(':')[1]
-    context.user_data['current_target_id'] = target_id
+    remember_user_state(context, update.effective_user.id, current_target_id=target_id)
     keyboard = [
         [InlineKeyboardButton("✅ Keywords (Require)", callback_data=f"ftype:keyword_include")],
         [InlineKeyboardButton("❌ Keywords (Exclude)", callback_data=f"ftype:keyword_exclude")],
+        [InlineKeyboardButton("✅ Phrases (Require)", callback_data="ftype:phrase_include"),
+         InlineKeyboardButton("❌ Phrases (Exclude)", callback_data="ftype:phrase_exclude")],
+        [InlineKeyboardButton("✅ Regex (Require)", callback_data="ftype:regex_include"),
+         InlineKeyboardButton("❌ Regex (Exclude)", callback_data="ftype:regex_exclude")],
+        [InlineKeyboardButton("🔀 Boolean (AND/OR)", callback_data="ftype:boolean")],
         [InlineKeyboardButton("🖼️ Content Type", callback_data=f"ftype:content_type")],
         [InlineKeyboardButton("⬅️ Back", callback_data=f"manage:{target_id}")]
     ]
@@ -268,20 +551,29 @@ async def add_filter_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def add_filter_keyword_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
     query = update.callback_query
     await query.answer()
     filter_type = query.data.split(':')[1]
-    context.user_data['current_filter_type'] = filter_type
+    remember_user_state(context, update.effective_user.id, current_filter_type=filter_type)
     await query.edit_message_text("Please send the keywords, separated by spaces (e.g., `btc eth announcement`).")
     return AWAITING_KEYWORD_INCLUDE if filter_type == 'keyword_include' else AWAITING_KEYWORD_EXCLUDE
 
 
+async def add_filter_pattern_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    filter_type = query.data.split(':')[1]
+    remember_user_state(context, update.effective_user.id, current_filter_type=filter_type)
+    await query.edit_message_text(PATTERN_FILTER_PROMPTS[filter_type])
+    return AWAITING_PATTERN
+
+
 async def add_filter_content_type_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
+    target_id = context.user_data.get('current_target_id')
+    if target_id is None:
+        return await expired_conversation(update, context)
     query = update.callback_query
     await query.answer()
-    target_id = context.user_data['current_target_id']
     keyboard = [
         [InlineKeyboardButton("Image 🖼️", callback_data="ctype:image"), InlineKeyboardButton("Video 🎬", callback_data="ctype:video")],
         [InlineKeyboardButton("Link 🔗", callback_data="ctype:link"), InlineKeyboardButton("Text Only ✍️", callback_data="ctype:text_only")],
@@ -294,25 +586,58 @@ async def add_filter_content_type_prompt(update: Update, context: ContextTypes.D
 
 
 async def save_keyword_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
-    target_id = context.user_data['current_target_id']
-    filter_type = context.user_data['current_filter_type']
-    for keyword in update.message.text.lower().split():
-        db_utils.add_filter(target_id, filter_type, keyword)
+    target_id = context.user_data.get('current_target_id')
+    filter_type = context.user_data.get('current_filter_type')
+    if target_id is None or filter_type is None:
+        return await expired_conversation(update, context)
+    db_utils.add_filters(target_id, filter_type, update.message.text.lower().split())
+    filter_engine.invalidate(target_id)
     await update.message.reply_text("✅ Filter(s) added successfully! Your watchlist is being updated...")
-    context.user_data.clear()
+    forget_user_state(context, update.effective_user.id)
+    await list_targets(update, context)
+    return ConversationHandler.END
+
+
+async def save_pattern_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Saves phrase, regex and boolean filters after validating every value."""
+    target_id = context.user_data.get('current_target_id')
+    filter_type = context.user_data.get('current_filter_type')
+    if target_id is None or filter_type is None:
+        return await expired_conversation(update, context)
+    text = update.message.text
+    if filter_type == 'boolean':
+        raw_values = [text]
+    else:
+        raw_values = [line for line in text.splitlines() if line.strip()]
+    try:
+        values = [filter_engine.validate_filter(filter_type, value) for value in raw_values]
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}\nPlease send it again, or /cancel.")
+        return AWAITING_PATTERN
+    if filter_type in ('regex_include', 'regex_exclude'):
+        existing = sum(1 for f in db_utils.get_filters_for_target(target_id) if f['filter_type'] == filter_type)
+        if existing + len(values) > filter_engine.MAX_REGEX_FILTERS:
+            await update.message.reply_text(f"❌ A watch can have at most {filter_engine.MAX_REGEX_FILTERS} regex filters of each kind.")
+            return AWAITING_PATTERN
+    db_utils.add_filters(target_id, filter_type, values)
+    filter_engine.invalidate(target_id)
+    await update.message.reply_text("✅ Filter(s) added successfully! Your watchlist is being updated...")
+    forget_user_state(context, update.effective_user.id)
     await list_targets(update, context)
     return ConversationHandler.END
 
 
 async def save_content_type_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
+    target_id = context.user_data.get('current_target_id')
+    if target_id is None:
+        return await expired_conversation(update, context)
     query = update.callback_query
     await query.answer()
     content_type = query.data.split(':')[1]
-    db_utils.add_filter(context.user_data['current_target_id'], 'content_type', content_type)
+    db_utils.add_filter(target_id, 'content_type', content_type)
+    filter_engine.invalidate(target_id)
     await query.edit_message_text(f"✅ Filter '{content_type}' added! Refreshing list...")
-    context.user_data.clear()
+    forget_user_state(context, update.effective_user.id)
     await list_targets(update, context, is_callback=True)
     return ConversationHandler.END
 
@@ -335,18 +660,17 @@ async def remove_filter_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
 async def delete_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
     query = update.callback_query
     await query.answer()
     _, filter_id, target_id_str = query.data.split(':')
     target_id = int(target_id_str)
     db_utils.remove_filter_by_id(int(filter_id))
+    filter_engine.invalidate(target_id)
     await manage_filters_menu(query, context, target_id)
 
 
 async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # ... (Sin cambios)
-    context.user_data.clear()
+    forget_user_state(context, update.effective_user.id)
     query = update.callback_query
     if query:
       await query.answer()
@@ -358,42 +682,71 @@ async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 # --- Core Logic ---
 
-async def send_formatted_message(context: ContextTypes.DEFAULT_TYPE, message: Update.message, destination_chat_id: str, target_id: int):
-    # ... (Sin cambios)
-    author = message.from_user.mention_html()
-    source_group_name = message.chat.title
-    
-    if message.chat.username:
-        message_link = f"https://t.me/{message.chat.username}/{message.message_id}"
+async def send_formatted_message(context: ContextTypes.DEFAULT_TYPE, render: rendering.MessageRender, destination_chat_id: str, target_id: int):
+    message = render.message
+    reply_markup = render.keyboard(target_id)
+    if message.text:
+        await context.bot.send_message(chat_id=destination_chat_id, text=render.content, parse_mode=ParseMode.HTML, reply_markup=reply_markup, disable_web_page_preview=True)
     else:
-        chat_id_for_link = str(message.chat.id)[4:]
-        message_link = f"https://t.me/c/{chat_id_for_link}/{message.message_id}"
-    
-    footer = (
-        f"\n\n🎯 — — — — — — — — 🎯\n"
-        f"🔔 <b>Notification from:</b> {author}\n"
-        f"🌐 <b>Source:</b> {source_group_name}"
-    )
-    keyboard = [[
-        InlineKeyboardButton("🚀 Jump to Message", url=message_link),
-        InlineKeyboardButton("🗑️ Stop Tracking", callback_data=f"stop_watch:{target_id}")
-    ]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        await message.copy(chat_id=destination_chat_id, caption=render.content, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
 
-    original_text = message.text or message.caption or ""
-    if original_text:
-        final_content = original_text + footer
-        if not message.text:
-            await message.copy(chat_id=destination_chat_id, caption=final_content, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-        else:
-            await context.bot.send_message(chat_id=destination_chat_id, text=final_content, parse_mode=ParseMode.HTML, reply_markup=reply_markup, disable_web_page_preview=True)
+
+async def send_album(context: ContextTypes.DEFAULT_TYPE, render: rendering.MessageRender, destination_chat_id: str, target_id: int):
+    """Sends a whole album with one send_media_group, followed by a single footer message."""
+    await context.bot.send_media_group(chat_id=destination_chat_id, media=render.album_media)
+    await context.bot.send_message(chat_id=destination_chat_id, text=render.footer, parse_mode=ParseMode.HTML, reply_markup=render.keyboard(target_id), disable_web_page_preview=True)
+
+
+async def deliver(context: ContextTypes.DEFAULT_TYPE, render: rendering.MessageRender, destination_chat_id: str, target_id: int):
+    if render.is_album:
+        await send_album(context, render, destination_chat_id, target_id)
     else:
-        caption_only_footer = (
-            f"🎯 — — — — — — — — 🎯\n"
-            f"🔔 <b>Notification from:</b> {author}\n"
-            f"🌐 <b>Source:</b> {source_group_name}"
-        )
-        await message.copy(chat_id=destination_chat_id, caption=caption_only_footer, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+        await send_formatted_message(context, render, destination_chat_id, target_id)
+
+
+def classify_delivery_error(error: TelegramError) -> str | None:
+    """Returns a suspension reason if the error means the destination is permanently unreachable."""
+    if isinstance(error, Forbidden):
+        return "forbidden"
+    if isinstance(error, BadRequest) and any(text in error.message.lower() for text in PERMANENT_BAD_REQUESTS):
+        return "chat_not_found"
+    return None
+
+
+async def suspend_destination(context: ContextTypes.DEFAULT_TYPE, destination_chat_id: str, reason: str):
+    """Pauses every watch delivering to a dead destination and tells the owners how to resume."""
+    user_ids = db_utils.suspend_destination(destination_chat_id, reason)
+    logger.warning(
+        f"Destination {destination_chat_id} suspended ({reason}) for users {user_ids}",
+        extra={'destination_chat_id': destination_chat_id, 'reason': reason, 'user_ids': user_ids}
+    )
+    for user_id in user_ids:
+        routing.remove_watcher(user_id)
+        try:
+            await context.bot.send_message(
+                user_id,
+                f"⚠️ I can no longer deliver alerts to your destination (<code>{destination_chat_id}</code>): "
+                f"{SUSPENSION_REASONS.get(reason, reason)}.\n\n"
+                "Your watches are paused. Add me back (or pick another chat) and send <code>/set_destination</code> there to resume.",
+                parse_mode=ParseMode.HTML,
+            )
+        except TelegramError as e:
+            logger.warning(f"Could not notify {user_id} about the suspended destination: {e}")
+
+
+def migrate_chat_id(old_chat_id: str, new_chat_id: str):
+    """Points watches and destinations at the supergroup a group was migrated to."""
+    db_utils.update_migrated_group_id(old_chat_id, new_chat_id)
+    routing.load()
+
+
+async def migration_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles the service messages Telegram sends when a group becomes a supergroup."""
+    message = update.effective_message
+    if message.migrate_to_chat_id:
+        migrate_chat_id(str(message.chat.id), str(message.migrate_to_chat_id))
+    elif message.migrate_from_chat_id:
+        migrate_chat_id(str(message.migrate_from_chat_id), str(message.chat.id))
 
 
 async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -402,48 +755,167 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
     if not (message and message.from_user and message.chat):
         return
 
-    watchers = db_utils.find_watchers_for_target(str(message.chat.id), message.from_user.id)
+    timer = logging_utils.StageTimer()
+    with timer.stage("routing_ms"):
+        watchers = routing.get_watchers(str(message.chat.id), message.from_user.id)
     if not watchers: return
 
-    text_content = message.text or message.caption or ""
+    if message.media_group_id:
+        buffer_album_message(context, message)
+        return
+
+    held = PENDING_BY_CHAT.get(message.chat.id)
+    if held:
+        # Un álbum anterior de este chat aún se está recogiendo: este mensaje espera detrás de él.
+        if not ADMISSION.has_room(reserved=pending_work_count()):
+            ADMISSION.record_shed("queue_full")
+            return
+        held.append({'messages': [message], 'watchers': watchers, 'timer': timer, 'ready': True})
+        return
+
+    ADMISSION.submit(message.chat.id, (context, [message], watchers, timer, time.perf_counter()))
+
+
+def pending_work_count() -> int:
+    return sum(len(entries) for entries in PENDING_BY_CHAT.values())
+
+
+def buffer_album_message(context: ContextTypes.DEFAULT_TYPE, message: Update.message):
+    """
+    Album items arrive as separate updates sharing a media_group_id. They are
+    collected for ALBUM_COLLECTION_WINDOW seconds and then routed together.
+    The album takes its place in the chat's arrival order as soon as its first
+    item arrives: later messages from the chat wait until it is flushed.
+    Work held this way counts against the pipeline queue, so a burst of albums
+    is shed here instead of growing without limit.
+    """
+    key = (message.chat.id, message.media_group_id)
+    album = PENDING_ALBUMS.get(key)
+    if album is None:
+        if not ADMISSION.has_room(reserved=pending_work_count()):
+            ADMISSION.record_shed("album_full")
+            return
+        album = PENDING_ALBUMS[key] = {'messages': [message], 'watchers': None, 'timer': None, 'ready': False}
+        PENDING_BY_CHAT.setdefault(message.chat.id, []).append(album)
+        context.job_queue.run_once(flush_album, config.ALBUM_COLLECTION_WINDOW, data=key)
+    elif len(album['messages']) < ALBUM_MAX_ITEMS:
+        album['messages'].append(message)
+
+
+async def flush_album(context: ContextTypes.DEFAULT_TYPE):
+    chat_id, _ = context.job.data
+    album = PENDING_ALBUMS.pop(context.job.data, None)
+    if album is None:
+        return
+    messages = album['messages'] = sorted(album['messages'], key=lambda m: m.message_id)
+    album['timer'] = timer = logging_utils.StageTimer()
+    with timer.stage("routing_ms"):
+        album['watchers'] = routing.get_watchers(str(chat_id), messages[0].from_user.id)
+    album['ready'] = True
+
+    # Se envía todo lo que estaba esperando detrás de álbumes ya completos, en orden de llegada.
+    entries = PENDING_BY_CHAT.get(chat_id, [])
+    while entries and entries[0]['ready']:
+        entry = entries.pop(0)
+        if entry['watchers']:
+            ADMISSION.submit(chat_id, (context, entry['messages'], entry['watchers'], entry['timer'], time.perf_counter()))
+    if not entries:
+        PENDING_BY_CHAT.pop(chat_id, None)
+
+
+async def process_work_item(item: tuple, load_level: int):
+    """Pipeline worker callback: routes a queued message at the load level seen when it was dequeued."""
+    context, messages, watchers, timer, enqueued_at = item
+    timer.record("queue_ms", (time.perf_counter() - enqueued_at) * 1000)
+    await route_messages(context, messages, watchers, timer, load_level)
+
+
+async def route_messages(context: ContextTypes.DEFAULT_TYPE, messages: list, watchers: list, timer: logging_utils.StageTimer, load_level: int = admission.LEVEL_NORMAL):
+    """
+    Filters and delivers a message (or a whole album) to every watcher of its author.
+    Under load, token analysis is dropped first, then normal watches get a digest
+    instead of each message, and finally only priority watches are served.
+    """
+    message = messages[0]
+    if len(messages) == 1:
+        prepared_text = filter_engine.PreparedText(message.text or message.caption or "")
+    else:
+        prepared_text = filter_engine.PreparedText("\n".join(m.caption for m in messages if m.caption))
+    render = rendering.MessageRender(messages)
+    # La CA y los tipos de contenido dependen solo del mensaje: se calculan una vez para todos los watches.
+    solana_ca = find_solana_ca(prepared_text.text)
+    content_types = message_content_types(messages, prepared_text.text, solana_ca)
+    dead_destinations = set()
+    delivered = 0
 
     for watch in watchers:
         target_id, watcher_id = watch['id'], watch['watcher_user_id']
-        filters = db_utils.get_filters_for_target(target_id)
-        
-        should_send, found_solana_ca = evaluate_filters(message, text_content, filters)
-        
+        log_fields = {'chat_id': message.chat.id, 'message_id': message.message_id, 'target_id': target_id, 'watcher_id': watcher_id}
+
+        if load_level >= admission.LEVEL_PRIORITY_ONLY and not watch['priority']:
+            ADMISSION.record_shed("low_priority")
+            continue
+
+        try:
+            with timer.stage("filters_ms"):
+                filters = filter_engine.get_compiled_filters(target_id)
+                should_send = evaluate_filters(prepared_text, content_types, filters)
+        except Exception:
+            # Los filtros rotos de un watch no deben impedir la entrega al resto.
+            logger.exception("Failed to evaluate filters", extra=log_fields)
+            continue
+
         if not should_send:
             continue
-        
+        found_solana_ca = solana_ca
+
         destination_chat_id = db_utils.get_user_destination(watcher_id)
-        if not destination_chat_id: continue
+        if not destination_chat_id or destination_chat_id in dead_destinations: continue
+        log_fields['destination_chat_id'] = destination_chat_id
+
+        if load_level >= admission.LEVEL_DIGEST and not watch['priority']:
+            add_to_digest(destination_chat_id, render)
+            ADMISSION.record_shed("digest")
+            continue
+        if found_solana_ca and load_level >= admission.LEVEL_NO_ANALYSIS:
+            ADMISSION.record_shed("analysis")
+            found_solana_ca = None
 
         try:
-            await send_formatted_message(context, message, destination_chat_id, target_id)
+            with timer.stage("send_ms"):
+                try:
+                    await deliver(context, render, destination_chat_id, target_id)
+                except ChatMigrated as e:
+                    migrate_chat_id(destination_chat_id, str(e.new_chat_id))
+                    destination_chat_id = str(e.new_chat_id)
+                    await deliver(context, render, destination_chat_id, target_id)
+            delivered += 1
 
             if found_solana_ca:
                 status_message = None
                 try:
-                    status_message = await context.bot.send_message(
-                        chat_id=destination_chat_id,
-                        text="🔍 <i>Analyzing Solana Token...</i>",
-                        parse_mode=ParseMode.HTML
-                    )
-                    
-                    # --- LLAMADA SIMPLIFICADA Y CORREGIDA ---
-                    analysis_result = api_client.get_token_analysis(found_solana_ca)
-                    analysis_text = api_client.format_token_analysis(analysis_result)
-                    
-                    await context.bot.edit_message_text(
-                        chat_id=destination_chat_id,
-                        message_id=status_message.message_id,
-                        text=analysis_text,
-                        parse_mode=ParseMode.HTML,
-                        disable_web_page_preview=True
-                    )
+                    with timer.stage("analysis_ms"):
+                        status_message = await context.bot.send_message(
+                            chat_id=destination_chat_id,
+                            text="🔍 <i>Analyzing Solana Token...</i>",
+                            parse_mode=ParseMode.HTML
+                        )
+                        
+                        # El análisis se comparte entre todos los destinos del mismo token.
+                        analysis_text = await rendering.token_analysis_text(found_solana_ca)
+                        
+                        await context.bot.edit_message_text(
+                            chat_id=destination_chat_id,
+                            message_id=status_message.message_id,
+                            text=analysis_text,
+                            parse_mode=ParseMode.HTML,
+                            disable_web_page_preview=True
+                        )
                 except Exception as analysis_error:
-                    logger.error(f"CRITICAL: Token analysis process failed for CA {found_solana_ca}. Error: {analysis_error}")
+                    logger.error(
+                        f"CRITICAL: Token analysis process failed for CA {found_solana_ca}. Error: {analysis_error}",
+                        extra={**log_fields, 'token_address': found_solana_ca}
+                    )
                     if status_message:
                         await context.bot.edit_message_text(
                             chat_id=destination_chat_id,
@@ -452,68 +924,90 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
                             parse_mode=ParseMode.HTML
                         )
         
+        except (Forbidden, BadRequest) as e:
+            reason = classify_delivery_error(e)
+            if not reason:
+                logger.error(f"Generic error on forwarding for watcher {watcher_id}: {e}", extra=log_fields)
+                continue
+            dead_destinations.add(destination_chat_id)
+            await suspend_destination(context, destination_chat_id, reason)
+        except Exception as e:
+            logger.error(f"Generic error on forwarding for watcher {watcher_id}: {e}", extra=log_fields)
+
+    logger.info(
+        "Message routed",
+        extra={
+            'chat_id': message.chat.id, 'message_id': message.message_id, 'album_size': len(messages),
+            'watchers': len(watchers), 'delivered': delivered, 'load_level': load_level, 'timings': timer.as_dict(),
+        }
+    )
+
+def add_to_digest(destination_chat_id: str, render: rendering.MessageRender):
+    """Collapses a message into the next digest for a destination (bounded to DIGEST_MAX_LINES)."""
+    lines = PENDING_DIGESTS.setdefault(destination_chat_id, [])
+    if len(lines) >= DIGEST_MAX_LINES:
+        DIGEST_OVERFLOW[destination_chat_id] = DIGEST_OVERFLOW.get(destination_chat_id, 0) + 1
+        return
+    lines.append(render.digest_line())
+
+
+async def flush_digests(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job: sends the digests collected while normal watches were being collapsed."""
+    for destination_chat_id in list(PENDING_DIGESTS):
+        lines = PENDING_DIGESTS.pop(destination_chat_id)
+        overflow = DIGEST_OVERFLOW.pop(destination_chat_id, 0)
+        text = "📰 <b>Digest</b> <i>(high load: messages were grouped)</i>\n\n" + "\n".join(lines)
+        if overflow:
+            text += f"\n\n…and {overflow} more."
+        try:
+            await context.bot.send_message(chat_id=destination_chat_id, text=text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        except (Forbidden, BadRequest) as e:
+            reason = classify_delivery_error(e)
+            if reason:
+                await suspend_destination(context, destination_chat_id, reason)
+            else:
+                logger.error(f"Could not send digest to {destination_chat_id}: {e}", extra={'destination_chat_id': destination_chat_id})
         except Exception as e:
-            logger.error(f"Generic error on forwarding for watcher {watcher_id}: {e}")
+            logger.error(f"Could not send digest to {destination_chat_id}: {e}", extra={'destination_chat_id': destination_chat_id})
 
-def evaluate_filters(message: Update.message, text_content: str, filters: list) -> (bool, str | None):
+
+async def log_pipeline_stats(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job: reports queue depth and how much work was shed."""
+    logger.info("Pipeline stats", extra=ADMISSION.stats())
+
+
+def message_content_types(messages: list, text: str, solana_ca: str | None) -> set:
+    """Tipos de contenido presentes en un mensaje o en cualquiera de los elementos de un álbum."""
+    content_types = set()
+    for message in messages:
+        if message.photo: content_types.add('image')
+        if message.video: content_types.add('video')
+        if message.entities and any(e.type in ['url', 'text_link'] for e in message.entities): content_types.add('link')
+        if message.text and not message.photo and not message.video and not message.document: content_types.add('text_only')
+    if solana_ca:
+        content_types.add('solana_ca')
+    if solana_ca or find_eth_ca(text):
+        content_types.add('contract_address')
+    return content_types
+
+
+def evaluate_filters(prepared_text: filter_engine.PreparedText, content_types: set, filters: filter_engine.CompiledFilters) -> bool:
     """
-    Evalúa un mensaje contra una lista de filtros.
-    Retorna (True, ca_encontrada) si el mensaje debe ser enviado, o (False, None) si no.
+    Evalúa un mensaje (o un álbum entero) contra los filtros compilados de un watch.
+    Retorna True si el mensaje debe ser enviado.
     """
     if not filters:
         # Si no hay filtros, siempre se envía.
-        # Comprobamos si hay CA de Solana para el análisis.
-        solana_ca = find_solana_ca(text_content)
-        return True, solana_ca
-
-    # Organizar filtros por tipo para una lógica más clara
-    include_keywords = [f['filter_value'] for f in filters if f['filter_type'] == 'keyword_include']
-    exclude_keywords = [f['filter_value'] for f in filters if f['filter_type'] == 'keyword_exclude']
-    content_types = [f['filter_value'] for f in filters if f['filter_type'] == 'content_type']
-
-    text_lower = text_content.lower()
-
-    # 1. Comprobación de palabras clave a excluir
-    if any(keyword in text_lower for keyword in exclude_keywords):
-        return False, None
-
-    # 2. Comprobación de palabras clave a incluir
-    # Si existen filtros de inclusión, al menos uno debe cumplirse.
-    if include_keywords and not any(keyword in text_lower for keyword in include_keywords):
-        return False, None
-
-    # 3. Comprobación de tipo de contenido
-    found_solana_ca = None
-    if content_types:
-        content_match = False
-        for ctype in content_types:
-            if ctype == 'image' and message.photo: content_match = True; break
-            if ctype == 'video' and message.video: content_match = True; break
-            if ctype == 'link' and message.entities and any(e.type in ['url', 'text_link'] for e in message.entities): content_match = True; break
-            if ctype == 'text_only' and message.text and not message.photo and not message.video and not message.document: content_match = True; break
-            
-            # Lógica para CA
-            ca = find_solana_ca(text_content)
-            if ctype == 'solana_ca' and ca:
-                found_solana_ca = ca
-                content_match = True
-                break
-            
-            # Puedes añadir más lógicas de CA aquí si quieres
-            if ctype == 'contract_address' and (ca or find_eth_ca(text_content)):
-                found_solana_ca = ca # Priorizamos Solana para el análisis
-                content_match = True
-                break
-        
-        # Si hay filtros de contenido y ninguno coincide, no se envía.
-        if not content_match:
-            return False, None
+        return True
 
-    # Si pasa todos los filtros, comprobamos si hay una CA de Solana para el análisis
-    if not found_solana_ca:
-        found_solana_ca = find_solana_ca(text_content)
-        
-    return True, found_solana_ca
+    # 1 y 2. Filtros de texto (palabras clave, frases, regex y expresiones booleanas)
+    # Cualquier exclusión descarta; si existen inclusiones, al menos una debe cumplirse.
+    if not filters.matches_text(prepared_text):
+        return False
+
+    # 3. Comprobación de tipo de contenido: basta con que esté presente uno de los pedidos.
+    # Si hay filtros de contenido y ninguno coincide, no se envía.
+    return not filters.content_types or not content_types.isdisjoint(filters.content_types)
 
 
 def find_solana_ca(text: str) -> str | None:
@@ -544,33 +1038,52 @@ def main() -> None:
     """Run the bot."""
     if not config.TELEGRAM_TOKEN:
         raise ValueError("Please add your BOT_TOKEN to the .env file or environment variables.")
+    if config.CONVERSATION_TIMEOUT >= config.STATE_IDLE_TIMEOUT:
+        # El estado de una conversación abierta no puede expirar antes que la propia conversación.
+        raise ValueError("CONVERSATION_TIMEOUT must be lower than STATE_IDLE_TIMEOUT.")
     
     db_utils.create_tables()
-    application = Application.builder().token(config.TELEGRAM_TOKEN).build()
+    builder = Application.builder().token(config.TELEGRAM_TOKEN).post_init(post_init)
+    if config.PERSIST_STATE:
+        builder = builder.persistence(state_store.SqlitePersistence(idle_timeout=config.STATE_IDLE_TIMEOUT))
+    application = builder.build()
 
     add_filter_conv = ConversationHandler(
         entry_points=[CallbackQueryHandler(add_filter_start, pattern='^add_filter:.*$')],
         states={
             SELECTING_FILTER_TYPE: [
                 CallbackQueryHandler(add_filter_keyword_prompt, pattern='^ftype:keyword.*$'),
+                CallbackQueryHandler(add_filter_pattern_prompt, pattern='^ftype:(phrase|regex|boolean).*$'),
                 CallbackQueryHandler(add_filter_content_type_prompt, pattern='^ftype:content_type$'),
                 CallbackQueryHandler(button_handler, pattern='^manage:.*$')
             ],
             AWAITING_KEYWORD_INCLUDE: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_keyword_filter)],
             AWAITING_KEYWORD_EXCLUDE: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_keyword_filter)],
-            AWAITING_CONTENT_TYPE: [CallbackQueryHandler(save_content_type_filter, pattern='^ctype:.*$')]
+            AWAITING_CONTENT_TYPE: [CallbackQueryHandler(save_content_type_filter, pattern='^ctype:.*$')],
+            AWAITING_PATTERN: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_pattern_filter)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)]
         },
         fallbacks=[
             CallbackQueryHandler(cancel_conversation, pattern='^cancel_conv$'),
+            CommandHandler("cancel", cancel_conversation),
             CallbackQueryHandler(button_handler, pattern='^show_list$')
         ],
         per_message=False,
+        conversation_timeout=config.CONVERSATION_TIMEOUT,
+        name="add_filter_conv",
+        persistent=config.PERSIST_STATE,
         map_to_parent={ ConversationHandler.END: ConversationHandler.END }
     )
 
     application.add_handler(CommandHandler("start", start, filters=filters.ChatType.PRIVATE))
     application.add_handler(CommandHandler("watch", watch, filters=filters.ChatType.PRIVATE))
     application.add_handler(CommandHandler("list", list_targets, filters=filters.ChatType.PRIVATE))
+    # Una importación puede tardar minutos resolviendo usuarios: no debe bloquear el resto de updates.
+    application.add_handler(CommandHandler("import", import_watchlist, filters=filters.ChatType.PRIVATE, block=False))
+    application.add_handler(CommandHandler("export", export_watchlist, filters=filters.ChatType.PRIVATE))
+    application.add_handler(MessageHandler(
+        filters.ChatType.PRIVATE & filters.Document.ALL & filters.CaptionRegex(r'^/import\b'), import_watchlist, block=False
+    ))
     
     application.add_handler(add_filter_conv)
     application.add_handler(CallbackQueryHandler(remove_filter_menu, pattern='^remove_filter_menu:.*$'))
@@ -580,9 +1093,14 @@ def main() -> None:
     group_filter = filters.ChatType.GROUP | filters.ChatType.SUPERGROUP
     application.add_handler(CommandHandler("get_id", get_id, filters=group_filter))
     application.add_handler(CommandHandler("set_destination", set_destination, filters=group_filter | filters.ChatType.CHANNEL))
+    application.add_handler(MessageHandler(filters.StatusUpdate.MIGRATE, migration_handler))
     application.add_handler(MessageHandler(group_filter & ~filters.COMMAND, group_message_handler))
 
-    print("Bot started (v6.0 - Final with Token Analysis)...")
+    application.job_queue.run_repeating(prune_idle_state, interval=60, first=60)
+    application.job_queue.run_repeating(flush_digests, interval=config.DIGEST_INTERVAL, first=config.DIGEST_INTERVAL)
+    application.job_queue.run_repeating(log_pipeline_stats, interval=60, first=60)
+
+    logger.info("Bot started (v6.0 - Final with Token Analysis)...")
     application.run_polling()
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+import asyncio
+import html
+from functools import lru_cache
+
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+)
+
+import api_client
+import config
+import state_store
+
+FOOTER_TEMPLATE = (
+    "🎯 — — — — — — — — 🎯\n"
+    "🔔 <b>Notification from:</b> {author}\n"
+    "🌐 <b>Source:</b> {source}"
+)
+DIGEST_LINE_TEMPLATE = "• {author} in <b>{source}</b>: {text} <a href='{link}'>↗</a>"
+DIGEST_TEXT_LIMIT = 100
+
+# token_address -> Task that fetches and formats its analysis; shared by every destination.
+_ANALYSIS_TASKS = state_store.ExpiringStore(maxsize=1000, ttl=config.ANALYSIS_CACHE_TTL)
+
+
+def build_message_link(message) -> str:
+    if message.chat.username:
+        return f"https://t.me/{message.chat.username}/{message.message_id}"
+    chat_id_for_link = str(message.chat.id)[4:]
+    return f"https://t.me/c/{chat_id_for_link}/{message.message_id}"
+
+
+@lru_cache(maxsize=50_000)
+def stop_tracking_button(target_id: int) -> InlineKeyboardButton:
+    """The 'Stop Tracking' button only depends on the watch, so it is shared across messages."""
+    return InlineKeyboardButton("🗑️ Stop Tracking", callback_data=f"stop_watch:{target_id}")
+
+
+def album_input_media(message):
+    """Converts an album item back into the InputMedia accepted by send_media_group."""
+    caption = {'caption': message.caption, 'caption_entities': message.caption_entities}
+    if message.photo:
+        return InputMediaPhoto(media=message.photo[-1].file_id, **caption)
+    if message.video:
+        return InputMediaVideo(media=message.video.file_id, **caption)
+    if message.document:
+        return InputMediaDocument(media=message.document.file_id, **caption)
+    if message.audio:
+        return InputMediaAudio(media=message.audio.file_id, **caption)
+    return None
+
+
+class MessageRender:
+    """
+    Everything sent for a source message (or album) that does not depend on the
+    destination: footer, jump link, final text and album media are built once,
+    and the keyboard once per watch, then reused for every watcher.
+    """
+
+    def __init__(self, messages: list):
+        self.messages = messages
+        self.message = message = messages[0]
+        self.is_album = len(messages) > 1
+        self.link = build_message_link(message)
+        self.footer = FOOTER_TEMPLATE.format(author=message.from_user.mention_html(), source=message.chat.title)
+
+        original_text = message.text or message.caption or ""
+        self.content = original_text + "\n\n" + self.footer if original_text else self.footer
+        self.album_media = [item for item in (album_input_media(m) for m in messages) if item] if self.is_album else None
+
+        self._jump_button = InlineKeyboardButton("🚀 Jump to Message", url=self.link)
+        self._keyboards = {}
+        self._digest_line = None
+
+    def keyboard(self, target_id: int) -> InlineKeyboardMarkup:
+        reply_markup = self._keyboards.get(target_id)
+        if reply_markup is None:
+            reply_markup = self._keyboards[target_id] = InlineKeyboardMarkup([[
+                self._jump_button, stop_tracking_button(target_id)
+            ]])
+        return reply_markup
+
+    def digest_line(self) -> str:
+        if self._digest_line is None:
+            message = self.message
+            text = message.text or message.caption or "📎 Media"
+            if len(text) > DIGEST_TEXT_LIMIT:
+                text = text[:DIGEST_TEXT_LIMIT] + "…"
+            self._digest_line = DIGEST_LINE_TEMPLATE.format(
+                author=message.from_user.mention_html(),
+                source=html.escape(message.chat.title or ""),
+                text=html.escape(text),
+                link=self.link,
+            )
+        return self._digest_line
+
+
+async def token_analysis_text(token_address: str) -> str:
+    """
+    Returns the formatted analysis of a token. Concurrent and repeated requests
+    for the same token within ANALYSIS_CACHE_TTL share a single DexScreener call.
+    """
+    task = _ANALYSIS_TASKS.get(token_address)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_token_analysis_text(token_address))
+        _ANALYSIS_TASKS.set(token_address, task)
+    try:
+        return await task
+    except Exception:
+        _ANALYSIS_TASKS.pop(token_address)
+        raise
+
+
+async def _fetch_token_analysis_text(token_address: str) -> str:
+    analysis_result = await asyncio.to_thread(api_client.get_token_analysis, token_address)
+    return api_client.format_token_analysis(analysis_result)
@@ -0,0 +1,70 @@
+import db_utils
+
+# (source_group_id, target_user_id) -> watches of that user in that group.
+_watches_by_source: dict[tuple[str, int], list[dict]] = {}
+# target_id -> (source_group_id, target_user_id), to find a watch when it is removed.
+_source_by_target: dict[int, tuple[str, int]] = {}
+
+
+def load():
+    """(Re)builds the routing index from the database."""
+    _watches_by_source.clear()
+    _source_by_target.clear()
+    for row in db_utils.get_all_watched_targets():
+        add_target(row['id'], row['watcher_user_id'], row['source_group_id'], row['target_user_id'], row['priority'])
+
+
+def get_watchers(source_group_id: str, target_user_id: int) -> list:
+    """Returns the watches for a user in a group, without touching the database."""
+    return _watches_by_source.get((str(source_group_id), int(target_user_id)), [])
+
+
+def add_target(target_id: int, watcher_user_id: int, source_group_id: str, target_user_id: int, priority: int = 0):
+    key = (str(source_group_id), int(target_user_id))
+    if target_id in _source_by_target:
+        return
+    _source_by_target[target_id] = key
+    # Se crea una lista nueva para no alterar la que pueda estar recorriendo un handler.
+    _watches_by_source[key] = _watches_by_source.get(key, []) + [
+        {'id': target_id, 'watcher_user_id': watcher_user_id, 'priority': priority}
+    ]
+
+
+def add_targets(rows: list):
+    for row in rows:
+        add_target(row['id'], row['watcher_user_id'], row['source_group_id'], row['target_user_id'], row['priority'])
+
+
+def set_priority(target_id: int, priority: int):
+    key = _source_by_target.get(target_id)
+    if key is None:
+        return
+    _watches_by_source[key] = [
+        {**w, 'priority': priority} if w['id'] == target_id else w for w in _watches_by_source[key]
+    ]
+
+
+def remove_target(target_id: int):
+    key = _source_by_target.pop(target_id, None)
+    if key is None:
+        return
+    remaining = [w for w in _watches_by_source.get(key, []) if w['id'] != target_id]
+    if remaining:
+        _watches_by_source[key] = remaining
+    else:
+        _watches_by_source.pop(key, None)
+
+
+def add_watcher(watcher_user_id: int):
+    """Routes every watch of a user again, e.g. after their destination is reactivated."""
+    for row in db_utils.get_user_watched_targets(watcher_user_id):
+        add_target(row['id'], watcher_user_id, row['source_group_id'], row['target_user_id'], row['priority'])
+
+
+def remove_watcher(watcher_user_id: int):
+    """Stops routing every watch of a user, e.g. when their destination is suspended."""
+    target_ids = [
+        w['id'] for watches in _watches_by_source.values() for w in watches if w['watcher_user_id'] == watcher_user_id
+    ]
+    for target_id in target_ids:
+        remove_target(target_id)
@@ -0,0 +1,137 @@
+import json
+import time
+from collections import OrderedDict
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import db_utils
+
+_MISSING = object()
+
+
+class ExpiringStore:
+    """
+    Size-bounded mapping whose entries expire `ttl` seconds after they were last written.
+    Entries are kept in write order, so the oldest ones are always at the front.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        return value
+
+    def set(self, key, value=None) -> list:
+        """Stores `value` and refreshes its expiry. Returns the keys evicted to stay within `maxsize`."""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        evicted = []
+        while len(self._data) > self.maxsize:
+            evicted_key, _ = self._data.popitem(last=False)
+            evicted.append(evicted_key)
+        return evicted
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def prune(self) -> list:
+        """Removes every expired entry and returns their keys."""
+        now = time.monotonic()
+        expired = []
+        while self._data:
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            del self._data[key]
+            expired.append(key)
+        return expired
+
+
+class SqlitePersistence(BasePersistence):
+    """
+    Persists user_data and conversation states in the bot database so that an
+    unfinished conversation survives a restart. Rows idle for longer than
+    `idle_timeout` seconds are discarded on load instead of being kept forever.
+    """
+
+    def __init__(self, idle_timeout: float, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.idle_timeout = idle_timeout
+
+    async def get_user_data(self) -> dict:
+        rows = db_utils.get_persisted_user_data(time.time() - self.idle_timeout)
+        return {row['user_id']: json.loads(row['data']) for row in rows}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        if not data:
+            db_utils.remove_persisted_user_data(user_id)
+            return
+        db_utils.save_persisted_user_data(user_id, json.dumps(data), time.time())
+
+    async def drop_user_data(self, user_id: int) -> None:
+        db_utils.remove_persisted_user_data(user_id)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = db_utils.get_persisted_conversations(name, time.time() - self.idle_timeout)
+        return {tuple(json.loads(row['conversation_key'])): row['state'] for row in rows}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        conversation_key = json.dumps(list(key))
+        if new_state is None:
+            db_utils.remove_persisted_conversation(name, conversation_key)
+        else:
+            db_utils.save_persisted_conversation(name, conversation_key, new_state, time.time())
+
+    # Este bot no usa chat_data, bot_data ni callback_data: no se guardan.
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass